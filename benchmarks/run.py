@@ -0,0 +1,277 @@
+'''
+Benchmarks pyportal against a local FakePortal, so results don't depend on the live portal
+(and the live portal isn't troubled by them). Run from the repository root:
+
+    python -m benchmarks.run --records 20000 --latency 0.02 --output results.json
+
+and compare with an earlier run to catch regressions (exits with status 1 if any benchmark is
+slower, or uses more memory, by more than the tolerance):
+
+    python -m benchmarks.run --compare baseline.json
+'''
+import argparse
+import json
+import multiprocessing
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import requests
+
+import pyportal
+from benchmarks.server import RESET_PATH, STATS_PATH, collections, countries, serve
+
+RESOURCE_ID = '05ff2255-c38a-40c9-b657-4ccb55ab2feb'
+
+# the number of times first() and count() are called, as each is a single small request
+REPEATS = 20
+
+
+def bench_all(api):
+    return sum(1 for _ in api.records(RESOURCE_ID).all())
+
+
+def bench_all_prefetch(api):
+    return sum(1 for _ in api.records(RESOURCE_ID).all(workers=4))
+
+
+def bench_all_stream(api):
+    return sum(1 for _ in api.records(RESOURCE_ID).all(stream=True))
+
+
+def bench_all_compact(api):
+    # keep the records, to measure how much memory they use
+    return len(list(api.records(RESOURCE_ID, compact=True).all()))
+
+
+def bench_all_kept(api):
+    return len(list(api.records(RESOURCE_ID).all()))
+
+
+def bench_all_sharded(api):
+    return sum(1 for _ in api.records(RESOURCE_ID).all(shards=4))
+
+
+def bench_all_cursor(api):
+    return sum(1 for _ in api.records(RESOURCE_ID, pagination='cursor').all())
+
+
+def bench_all_fields(api):
+    return sum(1 for _ in api.records(RESOURCE_ID, fields=['_id', 'catalogNumber']).all())
+
+
+def bench_all_filtered(api):
+    return sum(1 for _ in api.records(RESOURCE_ID, collectionCode='BOT').all())
+
+
+def bench_first(api):
+    for _ in range(REPEATS):
+        api.records(RESOURCE_ID).first()
+    return REPEATS
+
+
+def bench_count(api):
+    for _ in range(REPEATS):
+        api.records(RESOURCE_ID).count()
+    return REPEATS
+
+
+def bench_count_many(api):
+    searches = [{'resource_id': RESOURCE_ID, 'collectionCode': code, 'country': country}
+                for code in collections for country in countries]
+    api.count_many(searches)
+    return len(searches)
+
+
+def bench_assets(api):
+    return sum(1 for _ in api.assets(RESOURCE_ID).all())
+
+
+benchmarks = {
+    'all': bench_all,
+    'all_prefetch': bench_all_prefetch,
+    'all_stream': bench_all_stream,
+    'all_sharded': bench_all_sharded,
+    'all_kept': bench_all_kept,
+    'all_compact': bench_all_compact,
+    'all_cursor': bench_all_cursor,
+    'all_fields': bench_all_fields,
+    'all_filtered': bench_all_filtered,
+    'first': bench_first,
+    'count': bench_count,
+    'count_many': bench_count_many,
+    'assets': bench_assets
+    }
+
+
+def server_stats(base_url, reset=False):
+    root = base_url.rsplit('/api/', 1)[0]
+    return requests.get(root + (RESET_PATH if reset else STATS_PATH)).json()
+
+
+def measure(name, base_url, repeat=3):
+    '''
+    Run one benchmark: time it several times, then run it once more with memory tracing on
+    (which slows it down, so that run isn't timed).
+    :param name: the name of the benchmark
+    :param base_url: the base URL of the server
+    :param repeat: the number of timed runs
+    :return: dict of results
+    '''
+    benchmark = benchmarks[name]
+    times = []
+    items = 0
+    for _ in range(repeat):
+        with pyportal.API(base_url=base_url) as api:
+            server_stats(base_url, reset=True)
+            start = time.perf_counter()
+            items = benchmark(api)
+            times.append(time.perf_counter() - start)
+            served = server_stats(base_url)
+    with pyportal.API(base_url=base_url) as api:
+        tracemalloc.start()
+        try:
+            benchmark(api)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    seconds = statistics.median(times)
+    return {
+        'items': items,
+        'seconds': seconds,
+        'min_seconds': min(times),
+        'items_per_second': items / seconds if seconds > 0 else None,
+        'peak_memory_bytes': peak_memory,
+        'requests': served['requests'],
+        'errors': served['errors'],
+        'response_bytes': served['bytes']
+        }
+
+
+def compare(results, baseline, tolerance=0.2):
+    '''
+    Find benchmarks that got slower or used more memory than in an earlier run.
+    :param results: the results of this run
+    :param baseline: the results of the earlier run
+    :param tolerance: how much worse (as a fraction) a result can be before it's a regression
+    :return: list of descriptions of regressions
+    '''
+    regressions = []
+    for name, result in results['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        if before['items_per_second'] and result['items_per_second'] and \
+                result['items_per_second'] < before['items_per_second'] * (1 - tolerance):
+            regressions.append(f'{name}: {result["items_per_second"]:.0f} items/s, was '
+                               f'{before["items_per_second"]:.0f}')
+        if result['peak_memory_bytes'] > before['peak_memory_bytes'] * (1 + tolerance):
+            regressions.append(f'{name}: peak memory {result["peak_memory_bytes"]} bytes, was '
+                               f'{before["peak_memory_bytes"]}')
+        if result['requests'] > before['requests']:
+            regressions.append(f'{name}: {result["requests"]} requests, was '
+                               f'{before["requests"]}')
+    return regressions
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+        package_version = version('nhm-pyportal')
+    except (ImportError, PackageNotFoundError):
+        package_version = None
+    return {
+        'version': package_version,
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform()
+        }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark pyportal against a local server.')
+    parser.add_argument('--records', type=int, default=20000,
+                        help='number of records the server has')
+    parser.add_argument('--payload', type=int, default=200,
+                        help='bytes of free text in each record')
+    parser.add_argument('--media-rate', type=float, default=0.5,
+                        help='fraction of records with images')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the server waits before each response')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='random extra latency, in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of requests that fail')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of each benchmark')
+    parser.add_argument('--only', nargs='+', choices=list(benchmarks),
+                        help='run only these benchmarks')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare with the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='fraction by which a result can be worse before it\'s a regression')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = {
+        'records': args.records,
+        'payload': args.payload,
+        'media_rate': args.media_rate,
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'error_rate': args.error_rate,
+        'repeat': args.repeat
+        }
+
+    # the server runs in its own process, so it doesn't compete with the client for the GIL or
+    # show up in the client's memory use
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    server = multiprocessing.Process(target=serve, args=(sender,), daemon=True,
+                                     kwargs={k: v for k, v in config.items() if k != 'repeat'})
+    server.start()
+    try:
+        base_url = receiver.recv()
+        results = {}
+        for name in args.only or benchmarks:
+            results[name] = measure(name, base_url, args.repeat)
+            r = results[name]
+            print(f'{name:<14} {r["items"]:>8} items  {r["seconds"]:>8.3f}s  '
+                  f'{r["items_per_second"] or 0:>10.0f}/s  {r["requests"]:>6} requests  '
+                  f'{r["peak_memory_bytes"] / 2 ** 20:>8.1f} MiB peak')
+    finally:
+        server.terminate()
+        server.join()
+
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'environment': environment(),
+        'config': config,
+        'results': results
+        }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get('config') != config:
+            print('Warning: the baseline was run with different settings.', file=sys.stderr)
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'Regression: {regression}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
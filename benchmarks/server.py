@@ -0,0 +1,334 @@
+import bisect
+import gzip
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SEARCH_PATH = '/api/3/action/datastore_search'
+STATS_PATH = '/_stats'
+RESET_PATH = '/_reset'
+
+collections = ['BOT', 'ENT', 'MIN', 'PAL', 'ZOO']
+countries = ['United Kingdom', 'France', 'Brazil', 'Kenya', 'Australia', 'Japan', 'Canada',
+             'Madagascar', 'Indonesia', 'South Africa']
+families = ['Asteraceae', 'Carabidae', 'Felidae', 'Nymphalidae', 'Orchidaceae', 'Muridae',
+            'Rosaceae', 'Curculionidae', 'Ammonitidae', 'Corvidae']
+words = ['north', 'ridge', 'river', 'forest', 'valley', 'coast', 'upper', 'lower', 'near',
+         'road', 'hill', 'marsh', 'island', 'station', 'creek', 'west', 'east', 'plateau']
+
+
+def make_records(n, payload=200, media_rate=0.5, seed=0):
+    '''
+    Generate synthetic records that look like the specimen collection: the same kinds of
+    fields, with some records having images.
+    :param n: the number of records
+    :param payload: roughly how many bytes of free text to add to each record
+    :param media_rate: the fraction of records with images
+    :param seed: random seed, so the same arguments always give the same records
+    :return: list of record dicts, in _id order
+    '''
+    rng = random.Random(seed)
+    records = []
+    for i in range(1, n + 1):
+        family = rng.choice(families)
+        genus = family[:-4].capitalize() + rng.choice(['ia', 'us', 'ella', 'ops'])
+        collection = rng.choice(collections)
+        text = []
+        while sum(len(w) + 1 for w in text) < payload:
+            text.append(rng.choice(words))
+        record = {
+            '_id': i,
+            'occurrenceID': f'{rng.getrandbits(128):032x}',
+            'catalogNumber': f'{collection}{i:08d}',
+            'collectionCode': collection,
+            'family': family,
+            'genus': genus,
+            'scientificName': f'{genus} {rng.choice(words)}ensis',
+            'country': rng.choice(countries),
+            'locality': ' '.join(text),
+            'year': str(rng.randint(1750, 2020)),
+            'decimalLatitude': str(round(rng.uniform(-60, 70), 5)),
+            'decimalLongitude': str(round(rng.uniform(-180, 180), 5)),
+            'modified': f'20{rng.randint(10, 23)}-{rng.randint(1, 12):02d}-'
+                        f'{rng.randint(1, 28):02d}T00:00:00',
+            'associatedMedia': None
+            }
+        if rng.random() < media_rate:
+            media = []
+            for j in range(rng.randint(1, 3)):
+                asset_id = f'{rng.getrandbits(64):016x}'
+                media.append({
+                    '_id': asset_id,
+                    'assetID': asset_id,
+                    'identifier': f'https://data.nhm.ac.uk/media/{asset_id}',
+                    'mime': 'image/jpeg',
+                    'title': f'{record["catalogNumber"]} image {j + 1}'
+                    })
+            record['associatedMedia'] = json.dumps(media)
+        records.append(record)
+    return records
+
+
+class Server(ThreadingHTTPServer):
+    # clients making many requests at once may open lots of connections at the same time
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class Descending(object):
+    '''
+    Wraps a sort value so that it sorts in reverse.
+    '''
+    __slots__ = ['value']
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def sort_key(values, directions):
+    # nulls sort first, and values of different types don't need to be comparable
+    key = []
+    for value, direction in zip(values, directions):
+        part = (0, '') if value is None else (1, value)
+        key.append(Descending(part) if direction == 'desc' else part)
+    return tuple(key)
+
+
+class FakePortal(object):
+    def __init__(self, records=10000, payload=200, media_rate=0.5, latency=0.0, jitter=0.0,
+                 error_rate=0.0, error_status=503, gzip=True, seed=0, host='127.0.0.1',
+                 port=0):
+        '''
+        A local stand-in for the portal's datastore_search action, serving synthetic records.
+        It supports offset, limit, filters (including _has_image), fields, sort, q and after
+        (continuation tokens are returned with each page), and can be made slow or unreliable.
+        It also counts the requests it gets, and the most it was answering at once: GET /_stats
+        returns the counts and GET /_reset sets them back to zero.
+        :param records: the number of records to serve
+        :param payload: roughly how many bytes of free text to add to each record
+        :param media_rate: the fraction of records with images
+        :param latency: seconds to wait before answering each request
+        :param jitter: up to this many extra seconds are added to the latency at random
+        :param error_rate: the fraction of requests that fail (with Retry-After: 0)
+        :param error_status: the status code of the failures
+        :param gzip: compress responses if the client accepts it
+        :param seed: random seed for the records and the failures
+        :param host: the address to listen on
+        :param port: the port to listen on (0 picks a free one)
+        '''
+        self.records = make_records(records, payload, media_rate, seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.gzip = gzip
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._views = {}
+        self.reset()
+        self.server = Server((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        '''
+        The URL to give an API as its base_url.
+        '''
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/api/3'
+
+    def reset(self):
+        with self._lock:
+            self.stats = {'requests': 0, 'errors': 0, 'records': 0, 'bytes': 0,
+                          'max_in_flight': 0}
+            self._in_flight = 0
+
+    def start(self):
+        '''
+        Serve requests on a background thread.
+        :return: this instance
+        '''
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def update(self, records):
+        '''
+        Add records, or replace those with the same _id, e.g. to test syncing.
+        :param records: list of record dicts
+        '''
+        with self._lock:
+            by_id = {r['_id']: r for r in self.records}
+            by_id.update((r['_id'], r) for r in records)
+            self.records = sorted(by_id.values(), key=lambda r: r['_id'])
+            self._views = {}
+
+    def _view(self, filters, query, sort):
+        '''
+        The records matching a search, in order, with their sort keys. These are cached, so
+        paging through a search doesn't filter and sort the records again for every page.
+        '''
+        cache_key = json.dumps([filters, query, sort], sort_keys=True)
+        with self._lock:
+            view = self._views.get(cache_key)
+        if view is not None:
+            return view
+        records = self.records
+        for field, value in filters.items():
+            if field == '_has_image':
+                records = [r for r in records if bool(r['associatedMedia']) == bool(value)]
+                continue
+            values = {str(v) for v in (value if isinstance(value, list) else [value])}
+            records = [r for r in records if str(r.get(field)) in values]
+        if query:
+            query = query.lower()
+            records = [r for r in records if query in r['scientificName'].lower() or
+                       query in r['locality']]
+        fields = [s.split()[0] for s in sort]
+        directions = [(s.split() + ['asc'])[1].lower() for s in sort]
+        keys = [sort_key([r.get(f) for f in fields], directions) for r in records]
+        if sort:
+            order = sorted(range(len(records)), key=keys.__getitem__)
+            records = [records[i] for i in order]
+            keys = [keys[i] for i in order]
+        view = (records, keys, fields, directions)
+        with self._lock:
+            self._views[cache_key] = view
+        return view
+
+    def search(self, params):
+        '''
+        Answer a datastore_search request.
+        :param params: dict of parameter name to list of values, as from urllib.parse.parse_qs
+        :return: the response body as a dict
+        '''
+        filters = json.loads(params.get('filters', ['{}'])[0])
+        query = params.get('q', [None])[0]
+        sort = [s for value in params.get('sort', []) for s in value.split(',')]
+        offset = int(params.get('offset', ['0'])[0])
+        limit = int(params.get('limit', ['100'])[0])
+        records, keys, sort_fields, directions = self._view(filters, query, sort)
+        start = 0
+        if 'after' in params:
+            if not sort:
+                raise ValueError('after needs a sort')
+            after = json.loads(params['after'][0])
+            start = bisect.bisect_right(keys, sort_key(after, directions))
+        page = records[start + offset:start + offset + limit]
+        fields = [f for value in params.get('fields', []) for f in value.split(',')]
+        if fields:
+            page = [{f: r[f] for f in fields if f in r} for r in page]
+        result = {'resource_id': params.get('resource_id', [None])[0], 'total': len(records),
+                  'records': page}
+        if sort and len(page) > 0 and start + offset + len(page) < len(records):
+            last = records[start + offset + len(page) - 1]
+            result['after'] = [last.get(f) for f in sort_fields]
+        return {'success': True, 'result': result}
+
+    def _handler(self):
+        portal = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body are written separately, so don't let them wait for each other
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, headers=None):
+                data = json.dumps(body).encode('utf-8')
+                headers = dict(headers or {})
+                if portal.gzip and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    data = gzip.compress(data, compresslevel=1)
+                    headers['Content-Encoding'] = 'gzip'
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+                return len(data)
+
+            def do_GET(self):
+                url = urllib.parse.urlparse(self.path)
+                if url.path == STATS_PATH:
+                    with portal._lock:
+                        stats = dict(portal.stats)
+                    self._send(200, stats)
+                    return
+                if url.path == RESET_PATH:
+                    portal.reset()
+                    self._send(200, {'success': True})
+                    return
+                if url.path != SEARCH_PATH:
+                    self._send(404, {'success': False, 'error': {'message': 'Not found'}})
+                    return
+
+                with portal._lock:
+                    portal.stats['requests'] += 1
+                    portal._in_flight += 1
+                    portal.stats['max_in_flight'] = max(portal.stats['max_in_flight'],
+                                                        portal._in_flight)
+                    delay = portal.latency + portal._random.uniform(0, portal.jitter)
+                    failed = portal._random.random() < portal.error_rate
+                    if failed:
+                        portal.stats['errors'] += 1
+                try:
+                    self._search(url, delay, failed)
+                finally:
+                    with portal._lock:
+                        portal._in_flight -= 1
+
+            def _search(self, url, delay, failed):
+                if delay > 0:
+                    time.sleep(delay)
+                if failed:
+                    self._send(portal.error_status,
+                               {'success': False, 'error': {'message': 'Injected error'}},
+                               {'Retry-After': '0'})
+                    return
+                try:
+                    body = portal.search(urllib.parse.parse_qs(url.query))
+                except (KeyError, TypeError, ValueError) as e:
+                    self._send(409, {'success': False, 'error': {'message': str(e)}})
+                    return
+                size = self._send(200, body)
+                with portal._lock:
+                    portal.stats['records'] += len(body['result']['records'])
+                    portal.stats['bytes'] += size
+
+        return Handler
+
+
+def serve(connection, **kwargs):
+    '''
+    Run a FakePortal until the process is stopped, sending its base URL down a pipe once it's
+    listening. Used to run the server in a separate process from the benchmarks.
+    :param connection: the sending end of a multiprocessing Pipe
+    :param kwargs: arguments for FakePortal
+    '''
+    portal = FakePortal(**kwargs)
+    connection.send(portal.base_url)
+    connection.close()
+    portal.server.serve_forever()
@@ -1,2 +1,5 @@
-from .api import API
+from .api import API, BaseAPI
+from .aio import AsyncAPI
+from .cache import Cache
+from .local import LocalAPI
 from . import constants
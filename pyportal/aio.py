@@ -0,0 +1,325 @@
+import asyncio
+import json
+import logging
+
+from . import pagination as paging, rows
+from .api import BaseAPI
+from .constants import URLs
+from .decoding import loads
+from .iterators import ResultsIterator
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+log = logging.getLogger('pyportal')
+
+
+def query_items(params):
+    '''
+    Convert a dict of parameters into query items, in the same way requests does: lists become
+    repeated keys and None values are left out.
+    :param params: a dict of parameters
+    :return: a list of (key, value) tuples
+    '''
+    items = []
+    for k, v in params.items():
+        values = v if isinstance(v, (list, tuple)) else [v]
+        items += [(k, str(i)) for i in values if i is not None]
+    return items
+
+
+class AsyncSession(object):
+    def __init__(self, pool_size=10, concurrency=10, gzip=True, timeout=30):
+        '''
+        A pooled aiohttp session shared by an AsyncAPI instance and all the iterators it creates.
+        :param pool_size: maximum number of connections kept open
+        :param concurrency: maximum number of requests in flight at once
+        :param gzip: whether to ask the server for gzip-compressed responses
+        :param timeout: default timeout (in seconds) for each request; None waits forever
+        '''
+        if aiohttp is None:
+            raise ImportError('aiohttp is required for async searches: pip install aiohttp')
+        self.pool_size = pool_size
+        self.concurrency = concurrency
+        self.gzip = gzip
+        self.timeout = timeout
+        self._session = None
+        self._semaphore = None
+
+    @property
+    def session(self):
+        '''
+        The underlying aiohttp session, created on first use inside the running event loop.
+        :return: an aiohttp.ClientSession instance
+        '''
+        if self._session is None:
+            headers = {
+                'Accept-Encoding': 'gzip, deflate' if self.gzip else 'identity'
+                }
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers=headers)
+        return self._session
+
+    @property
+    def semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def get(self, url, params=None, headers=None):
+        '''
+        Make a GET request and decode the response.
+        :param url: the URL to request
+        :param params: query parameters
+        :param headers: any extra headers for this request
+        :return: a tuple of (response, decoded JSON body)
+        '''
+        async with self.semaphore:
+            async with self.session.get(url, params=query_items(params or {}),
+                                        headers=headers) as r:
+                body = await r.json(loads=loads, content_type=None) if r.ok else None
+                return r, body
+
+    async def close(self):
+        '''
+        Close all pooled connections.
+        '''
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class AsyncResultsIterator(object):
+    def __init__(self, url, auth=None, offset=0, session=None, pagination=paging.OFFSET,
+                 compact=False, **params):
+        '''
+        :param url: the API URL to request results from
+        :param auth: an API key (optional)
+        :param offset: skip n records (optional)
+        :param session: an AsyncSession to make requests through (optional; a new one is
+                        created if not provided)
+        :param pagination: 'offset' to page by increasing the offset, or 'cursor' to continue
+                           each page from the end of the last one (optional)
+        :param compact: if True, records are returned as compact, read-only Row objects rather
+                        than dicts (optional)
+        :param params: parameters to send with the API request (e.g. filters, query etc)
+        '''
+        if pagination not in paging.strategies:
+            raise ValueError(f'"{pagination}" is not a pagination strategy; use one of '
+                             f'{paging.strategies}.')
+        self.url = url
+        self.offset = offset
+        self._original_offset = offset
+        self.params = params
+        self.auth = auth
+        self.session = session if session is not None else AsyncSession()
+        self.pagination = pagination
+        self.compact = compact
+        self._rows = rows.RowFactory() if compact else None
+        self.after = None
+        self._finished = False
+        self.fields = list(params['fields']) if params.get('fields') else None
+        self._field_set = set(self.fields) if self.fields is not None else None
+        if pagination == paging.CURSOR:
+            self.params['sort'] = paging.keyset_sort(self.params.get('sort'))
+
+    async def _get(self, **overrides):
+        '''
+        Make the API request.
+        :param overrides: parameters to send instead of the search's own, e.g. limit (optional)
+        :return: the 'result' dict, or None if no result is returned
+        '''
+        if self.after is None:
+            params = dict(self.params, offset=self.offset, **overrides)
+        else:
+            params = dict(self.params, offset=0, after=json.dumps(self.after), **overrides)
+        headers = {
+            'Authorization': self.auth
+            } if self.auth is not None else {}
+        r, body = await self.session.get(self.url, params=params, headers=headers)
+        if not r.ok:
+            log.error(f'HTTP request failed ({r.status}) for {self.url}.')
+            log.error(r.reason)
+            raise aiohttp.ClientResponseError(r.request_info, r.history, status=r.status,
+                                              message=r.reason)
+        return ResultsIterator.parse_result(body)
+
+    def _reset(self):
+        '''
+        Reset the iterator to its construction state.
+        '''
+        self.offset = self._original_offset
+        self.after = None
+        self._finished = False
+
+    _continue = ResultsIterator._continue
+
+    async def next(self):
+        '''
+        Get the next 'page' of results, then set the new offset for the following page. Raises
+        StopAsyncIteration if there's no more results.
+        :return: list of records (or what they're converted into, e.g. Rows or asset tuples)
+        '''
+        if self._finished:
+            self._reset()
+            raise StopAsyncIteration
+        try:
+            result = await self._get()
+        except aiohttp.ClientResponseError:
+            self._reset()
+            raise StopAsyncIteration
+        no_records = result is None or len(result.get('records') or []) == 0
+        if no_records or self.offset >= result.get('total', 0):
+            log.debug('Nothing else in queue.')
+            self._reset()
+            raise StopAsyncIteration
+        self.offset += len(result['records'])
+        if self.pagination == paging.CURSOR:
+            self._continue(result)
+        return [self._convert(record) for record in result['records']]
+
+    def _convert(self, record):
+        '''
+        Convert a record from the API into the item returned by next() and all().
+        :param record: a record dict
+        :return: the record, or a Row in compact mode
+        '''
+        record = self._trim(record)
+        return self._rows.row(record) if self.compact else record
+
+    _trim = ResultsIterator._trim
+
+    async def all(self):
+        '''
+        An async generator that paginates automatically and yields individual records.
+        :return: async generator that yields dicts
+        '''
+        self.params['limit'] = 1000
+        while True:
+            try:
+                page = await self.next()
+            except StopAsyncIteration:
+                break
+            for record in page:
+                yield record
+
+    def __aiter__(self):
+        return self.all().__aiter__()
+
+    async def first(self):
+        '''
+        Returns the first record (taking offset into account).
+        :return: dict
+        '''
+        self._reset()
+        self.params['limit'] = 1
+        page = await self.next()
+        self._reset()
+        return page[0]
+
+    async def count(self):
+        '''
+        Returns a count of all records in the result set. Only the total is requested, not any
+        records.
+        :return: int
+        '''
+        self._reset()
+        result = await self._get(limit=0)
+        return result.get('total', 0) if result is not None else 0
+
+
+class AsyncAssetIterator(AsyncResultsIterator):
+    def _convert(self, record):
+        '''
+        Convert a record into an asset tuple. Does not group assets together by record. In
+        compact mode, the assets are only decoded when they're used.
+        :param record: a record dict
+        :return: tuple in the form (record_id, list of asset dicts)
+        '''
+        return rows.to_asset(record, lazy=self.compact)
+
+    async def count(self):
+        raise NotImplementedError
+
+
+class AsyncAPI(BaseAPI):
+    results_iterator = AsyncResultsIterator
+    asset_iterator = AsyncAssetIterator
+
+    def __init__(self, api_key=None, pool_size=10, concurrency=10, gzip=True, timeout=30,
+                 base_url=URLs.base_url):
+        '''
+        An asyncio version of API; records() and assets() return iterators that support
+        'async for', and first()/count() must be awaited.
+        :param api_key: an API key (optional)
+        :param pool_size: maximum number of connections kept open to the portal (optional)
+        :param concurrency: maximum number of requests in flight at once across all searches
+                            (optional)
+        :param gzip: whether to request gzip-compressed responses (optional)
+        :param timeout: default timeout in seconds for each request (optional)
+        :param base_url: the base URL of the API, e.g. to use a test server (optional)
+        '''
+        super(AsyncAPI, self).__init__(api_key, base_url)
+        self.session = AsyncSession(pool_size=pool_size, concurrency=concurrency, gzip=gzip,
+                                    timeout=timeout)
+
+    async def _run_many(self, function, searches, paged=True):
+        '''
+        Await a coroutine function on the search for each set of parameters concurrently,
+        running identical searches only once.
+        :param function: the coroutine function to call with each search
+        :param searches: a list or dict of dicts of parameters for records()
+        :param paged: whether the offset and limit make a difference to the result (optional)
+        :return: dict of the key (or list index) of each set of parameters to its result
+        '''
+        keys, unique = self._unique_searches(searches, paged)
+        results = await asyncio.gather(*(function(search) for search in unique.values()))
+        results = dict(zip(unique, results))
+        return {key: results[search_key] for key, search_key in keys.items()}
+
+    async def count_many(self, searches):
+        '''
+        Count the records in several searches at once (up to the concurrency limit). Only the
+        totals are requested, and identical searches are only counted once.
+        :param searches: a list or dict of dicts of parameters for records() (e.g. from
+                         from_url())
+        :return: dict of the key (or list index) of each search to its count
+        '''
+        return await self._run_many(lambda search: search.count(), searches, paged=False)
+
+    async def search_many(self, searches, fetch_all=False):
+        '''
+        Run several searches at once (up to the concurrency limit). Identical searches are only
+        run once.
+        :param searches: a list or dict of dicts of parameters for records() (e.g. from
+                         from_url()), which can include offset and limit
+        :param fetch_all: if True, get every record in each search rather than just the first
+                          page (optional)
+        :return: dict of the key (or list index) of each search to a list of its records
+        '''
+        async def run(search):
+            if fetch_all:
+                return [record async for record in search.all()]
+            try:
+                return await search.next()
+            except StopAsyncIteration:
+                return []
+
+        results = await self._run_many(run, searches)
+        return {key: list(records) for key, records in results.items()}
+
+    async def close(self):
+        '''
+        Close the connection pool shared by this instance and its iterators.
+        '''
+        await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
@@ -1,16 +1,36 @@
 import logging
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
+from .cache import Cache
 from .endpoints import endpoints
 from .errors import IncorrectURLError
 from .iterators import AssetIterator, ResultsIterator
+from .constants import URLs
+from .control import RequestController
+from .downloads import AssetDownloader
+from .export import Exporter
+from .mirror import Mirror
+from .session import Session
 
 log = logging.getLogger('pyportal')
 
 
-class API(object):
-    def __init__(self, api_key=None):
+class BaseAPI(object):
+    '''
+    Builds searches; subclasses decide how the requests for them are made.
+    '''
+    results_iterator = ResultsIterator
+    asset_iterator = AssetIterator
+
+    def __init__(self, api_key=None, base_url=URLs.base_url):
+        '''
+        :param api_key: an API key (optional)
+        :param base_url: the base URL of the API (optional)
+        '''
         self.key = api_key
+        self.base_url = base_url
+        self.session = None
 
     @classmethod
     def from_url(cls, url):
@@ -45,23 +65,51 @@ class API(object):
             extracted_params['fields'] = fields.split(',')
         return extracted_params
 
-    def _get_result_iterator(self, endpoint, iterator, offset, limit, **kwargs):
+    def _get_result_iterator(self, endpoint, iterator, offset, limit, pagination, compact=False,
+                             **kwargs):
         '''
         Common method to format parameters and return a results iterator.
         :param endpoint: the target endpoint
         :param iterator: the type of results iterator, e.g. ResultsIterator
         :param offset: skip n records
         :param limit: number of results per page
+        :param pagination: the pagination strategy, i.e. 'offset' or 'cursor'
+        :param compact: whether to return compact Rows instead of dicts
         :param kwargs: any other arguments, e.g. query, filters
         :return: a ResultIterator (or subclass) instance
         '''
         params = endpoint.format_params(**kwargs)
-        return iterator(endpoint.url, auth=self.key, offset=offset, limit=limit, **params)
+        return iterator(endpoint.url_for(self.base_url), auth=self.key, offset=offset,
+                        session=self.session, pagination=pagination, compact=compact,
+                        limit=limit, **params)
+
+    def _unique_searches(self, searches, paged=True):
+        '''
+        Build a records() search for each set of parameters, sharing one search between sets
+        that would make identical requests.
+        :param searches: a list or dict of dicts of parameters for records(), e.g. from from_url()
+        :param paged: whether the offset and limit make a difference to the result (optional)
+        :return: tuple of (dict of the key (or list index) of each set of parameters to the key
+                 of its search, dict of search key to search)
+        '''
+        if not isinstance(searches, dict):
+            searches = dict(enumerate(searches))
+        keys = {}
+        unique = {}
+        for key, params in searches.items():
+            search = self.records(**params)
+            request = dict(search.params, offset=search.offset)
+            if not paged:
+                request.pop('offset')
+                request.pop('limit', None)
+            keys[key] = Cache.key(search.url, request, search.auth)
+            unique.setdefault(keys[key], search)
+        return keys, unique
 
     # COMMON ACTIONS
 
     def records(self, resource_id, offset=0, limit=100, sort=None, fields=None, query=None,
-                **filters):
+                pagination='offset', compact=False, **filters):
         '''
         Use the datastore_search endpoint to search for records in a resource.
         :param resource_id: the id of the resource, i.e. the id after /resource/ in the URL
@@ -70,16 +118,23 @@ class API(object):
         :param sort: list of fields and directions (asc, desc) to sort the records by (optional)
         :param fields: list of fields to return, default is all (optional)
         :param query: free text search (optional)
+        :param pagination: 'offset' (the default) pages by increasing the offset; 'cursor'
+                           continues each page from the end of the last one, which stays fast
+                           and consistent deep into large result sets (optional)
+        :param compact: if True, return records as compact, read-only Row objects instead of
+                        dicts, which use much less memory; JSON fields like associatedMedia
+                        are only decoded when they're used (optional)
         :param filters: filter by record attributes
         :return: a ResultIterator instance
         '''
         sort = sort or []
         fields = fields or []
-        return self._get_result_iterator(endpoints.datastore_search, ResultsIterator, offset, limit,
-                                         sort=sort, fields=fields, resource_id=resource_id,
-                                         filters=filters, q=query)
+        return self._get_result_iterator(endpoints.datastore_search, self.results_iterator, offset,
+                                         limit, pagination, compact, sort=sort, fields=fields,
+                                         resource_id=resource_id, filters=filters, q=query)
 
-    def assets(self, resource_id, offset=0, limit=100, sort=None, query=None, **filters):
+    def assets(self, resource_id, offset=0, limit=100, sort=None, query=None, pagination='offset',
+               compact=False, **filters):
         '''
         Use the datastore_search endpoint to search for assets attached to records in a resource. Ignores records without images.
         :param resource_id: the id of the resource, i.e. the id after /resource/ in the URL
@@ -88,12 +143,184 @@ class API(object):
         :param sort: list of fields and directions (asc, desc) to sort the records by (
         optional)
         :param query: free text search (optional)
+        :param pagination: 'offset' (the default) pages by increasing the offset; 'cursor'
+                           continues each page from the end of the last one, which stays fast
+                           and consistent deep into large result sets (optional)
+        :param compact: if True, each record's assets are only decoded when they're used
+                        (optional)
         :param filters: filter by record attributes
         :return: an AssetIterator instance
         '''
         filters['_has_image'] = True
         sort = sort or []
         fields = ['_id', 'associatedMedia']
-        return self._get_result_iterator(endpoints.datastore_search, AssetIterator, offset, limit,
-                                         sort=sort, fields=fields, resource_id=resource_id,
-                                         filters=filters, q=query)
+        return self._get_result_iterator(endpoints.datastore_search, self.asset_iterator, offset,
+                                         limit, pagination, compact, sort=sort, fields=fields,
+                                         resource_id=resource_id, filters=filters, q=query)
+
+
+class API(BaseAPI):
+    def __init__(self, api_key=None, pool_size=10, keep_alive=True, gzip=True, timeout=30,
+                 cache=None, retries=3, rate_limit=None, adaptive_limit=False,
+                 base_url=URLs.base_url):
+        '''
+        :param api_key: an API key (optional)
+        :param pool_size: maximum number of connections kept open to the portal (optional)
+        :param keep_alive: whether to reuse connections between requests (optional)
+        :param gzip: whether to request gzip-compressed responses (optional)
+        :param timeout: default timeout in seconds for each request (optional)
+        :param cache: a pyportal.cache.Cache to serve repeated requests from (optional)
+        :param retries: how many times to retry requests that fail with a server error, a 429,
+                        a timeout or a connection error, with exponential backoff (optional)
+        :param rate_limit: maximum number of requests per second, shared by all the searches
+                           created by this instance (optional)
+        :param adaptive_limit: if True, all() adjusts its page size according to how long
+                               pages take (optional)
+        :param base_url: the base URL of the API, e.g. to use a test server (optional)
+        '''
+        super(API, self).__init__(api_key, base_url)
+        controller = RequestController(retries=retries, rate_limit=rate_limit,
+                                       adaptive_limit=adaptive_limit)
+        self.session = Session(pool_size=pool_size, keep_alive=keep_alive, gzip=gzip,
+                               timeout=timeout, cache=cache, controller=controller)
+
+    @property
+    def cache(self):
+        return self.session.cache
+
+    @property
+    def hooks(self):
+        '''
+        Functions called as requests are made, for monitoring; add one with e.g.
+        api.hooks.add('on_request_end', my_function). See pyportal.hooks for the events.
+        :return: a pyportal.hooks.Hooks instance
+        '''
+        return self.session.hooks
+
+    def close(self):
+        '''
+        Close the connection pool shared by this instance and its iterators.
+        '''
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _run_many(self, function, searches, workers, paged=True):
+        '''
+        Call a function on the search for each set of parameters in a thread pool, running
+        identical searches only once.
+        :param function: the function to call with each search
+        :param searches: a list or dict of dicts of parameters for records()
+        :param workers: the number of searches to run at once; defaults to the pool size
+        :param paged: whether the offset and limit make a difference to the result (optional)
+        :return: dict of the key (or list index) of each set of parameters to its result
+        '''
+        keys, unique = self._unique_searches(searches, paged)
+        workers = workers or self.session.pool_size
+        with ThreadPoolExecutor(max_workers=max(min(workers, len(unique)), 1)) as executor:
+            results = dict(zip(unique, executor.map(function, unique.values())))
+        return {key: results[search_key] for key, search_key in keys.items()}
+
+    def count_many(self, searches, workers=None):
+        '''
+        Count the records in several searches at once. Only the totals are requested, and
+        identical searches are only counted once.
+        :param searches: a list or dict of dicts of parameters for records() (e.g. from
+                         from_url()), like [{'resource_id': ..., 'collectionCode': 'bot'}, ...]
+        :param workers: the number of requests to make at once; defaults to the pool size
+                        (optional)
+        :return: dict of the key (or list index) of each search to its count
+        '''
+        return self._run_many(lambda search: search.count(), searches, workers, paged=False)
+
+    def search_many(self, searches, workers=None, fetch_all=False):
+        '''
+        Run several searches at once. Identical searches are only run once.
+        :param searches: a list or dict of dicts of parameters for records() (e.g. from
+                         from_url()), which can include offset and limit
+        :param workers: the number of searches to run at once; defaults to the pool size
+                        (optional)
+        :param fetch_all: if True, get every record in each search rather than just the first
+                          page (optional)
+        :return: dict of the key (or list index) of each search to a list of its records
+        '''
+        def run(search):
+            search.raise_errors = True
+            if fetch_all:
+                return list(search.all())
+            try:
+                return search.next()
+            except StopIteration:
+                return []
+
+        return {key: list(records) for key, records in
+                self._run_many(run, searches, workers).items()}
+
+    def mirror(self, resource_id, path, modified_field=None, index_fields=None):
+        '''
+        Copy a resource into a local SQLite file, which LocalAPI can then search much faster
+        than the portal. If the file is already a mirror of the resource, it's synced instead:
+        only new records (and, if there's a modified_field, changed ones) are requested.
+        :param resource_id: the id of the resource, i.e. the id after /resource/ in the URL
+        :param path: the path of the SQLite file
+        :param modified_field: a field holding when each record was last changed, used to
+                               find changed records (optional)
+        :param index_fields: fields to index, e.g. ones you often filter or sort on (optional)
+        :return: a pyportal.mirror.Mirror instance
+        '''
+        mirror = Mirror(self, resource_id, path, modified_field=modified_field,
+                        index_fields=index_fields)
+        mirror.sync()
+        return mirror
+
+    def download_assets(self, resource_id, dest, size='preview', workers=8, per_host=4,
+                        query=None, **filters):
+        '''
+        Download the image files for every asset in a search, several at a time. Files that have
+        already been downloaded are skipped, and partial downloads are resumed, so an
+        interrupted run can be restarted with the same arguments. If a page of assets can't be
+        fetched, a requests.HTTPError is raised rather than the rest of the search being
+        missed.
+        :param resource_id: the id of the resource, i.e. the id after /resource/ in the URL
+        :param dest: the directory to save files in; each is named after its asset ID
+        :param size: 'preview' (the default) or 'original' (optional)
+        :param workers: number of files to download at once (optional)
+        :param per_host: maximum number of downloads at once from any one host (optional)
+        :param query: free text search (optional)
+        :param filters: filter by record attributes
+        :return: a DownloadStats instance, with totals and throughput
+        '''
+        downloader = AssetDownloader(self.session, dest, size=size, workers=workers,
+                                     per_host=per_host)
+        search = self.assets(resource_id, query=query, **filters)
+        search.raise_errors = True
+        return downloader.run(search.all())
+
+    def export(self, resource_id, path, chunk_size=10000, resume=False, offset=0, sort=None,
+               fields=None, query=None, pagination='offset', **filters):
+        '''
+        Export every record in a search to a gzip-compressed NDJSON file (one JSON record per
+        line). A checkpoint is saved alongside the file (as path + '.checkpoint') after each
+        chunk is written, so an export that fails part way through can be continued by running
+        it again with resume=True. Once all the records have been written, the total is checked
+        against the search's count().
+        :param resource_id: the id of the resource, i.e. the id after /resource/ in the URL
+        :param path: the path of the file to write, e.g. 'records.ndjson.gz'
+        :param chunk_size: number of records to write between checkpoints (optional)
+        :param resume: continue from the checkpoint if there is one (optional)
+        :param offset: skip n records (optional)
+        :param sort: list of fields and directions (asc, desc) to sort the records by (optional)
+        :param fields: list of fields to return, default is all (optional)
+        :param query: free text search (optional)
+        :param pagination: 'offset' or 'cursor'; cursor is faster and more consistent for large
+                           exports (optional)
+        :param filters: filter by record attributes
+        :return: the number of records exported
+        '''
+        search = self.records(resource_id, offset=offset, sort=sort, fields=fields, query=query,
+                              pagination=pagination, **filters)
+        return Exporter(search, path, chunk_size=chunk_size).run(resume=resume)
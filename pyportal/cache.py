@@ -0,0 +1,227 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger('pyportal')
+
+
+class CachedResponse(object):
+    def __init__(self, url, status_code, content, reason=''):
+        '''
+        A stand-in for a requests response, rebuilt from a cache entry.
+        :param url: the URL that was requested
+        :param status_code: the HTTP status code of the original response
+        :param content: the body of the original response, as bytes
+        :param reason: the HTTP reason phrase of the original response
+        '''
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.reason = reason
+        self.headers = {}
+        self.from_cache = True
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class Cache(object):
+    def __init__(self, path=None, ttl=3600, max_bytes=256 * 1024 ** 2,
+                 memory_bytes=32 * 1024 ** 2):
+        '''
+        A two-tier cache of successful API responses: an in-memory LRU in front of an optional
+        SQLite file. Entries are keyed on the URL plus the normalised request parameters.
+        :param path: path to a SQLite file for the on-disk tier; if None, only the in-memory
+                     tier is used (optional)
+        :param ttl: how long (in seconds) an entry stays fresh; None means forever (optional)
+        :param max_bytes: maximum total size of the response bodies stored on disk (optional)
+        :param memory_bytes: maximum total size of the response bodies held in memory
+                             (optional)
+        '''
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.RLock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, '
+                             'url TEXT, status INTEGER, body BLOB, size INTEGER, expires REAL, '
+                             'accessed REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed '
+                             'ON responses (accessed)')
+            self._db.commit()
+
+    @staticmethod
+    def key(url, params=None, auth=None):
+        '''
+        Build a cache key for a request. Parameters are normalised so that equivalent requests
+        share a key: None values are dropped, everything else is compared as a string, and JSON
+        parameters (e.g. filters) are re-encoded with sorted keys.
+        :param url: the URL to request
+        :param params: query parameters
+        :param auth: the API key used for the request, if any (optional)
+        :return: str
+        '''
+        normalised = {}
+        for k, v in (params or {}).items():
+            if v is None:
+                continue
+            if isinstance(v, str) and v.startswith('{'):
+                try:
+                    v = json.dumps(json.loads(v), sort_keys=True)
+                except ValueError:
+                    pass
+            normalised[k] = [str(i) for i in v] if isinstance(v, (list, tuple)) else str(v)
+        key = url + '?' + json.dumps(normalised, sort_keys=True)
+        if auth is not None:
+            key += '#' + hashlib.sha256(auth.encode('utf-8')).hexdigest()
+        return key
+
+    @property
+    def stats(self):
+        '''
+        Hit and miss counts for this cache.
+        :return: dict
+        '''
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total > 0 else 0.0
+            }
+
+    def get(self, key):
+        '''
+        Look up a fresh response in the cache, checking memory first and then disk.
+        :param key: a key from Cache.key()
+        :return: a CachedResponse, or None if there's no fresh entry
+        '''
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and (entry[3] is None or entry[3] > now):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return CachedResponse(*entry[:3])
+            if entry is not None:
+                self._forget(key)
+            if self._db is not None:
+                row = self._db.execute('SELECT url, status, body, expires FROM responses '
+                                       'WHERE key = ?', (key,)).fetchone()
+                if row is not None and (row[3] is None or row[3] > now):
+                    self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?',
+                                     (now, key))
+                    self._db.commit()
+                    self._remember(key, row[0], row[1], bytes(row[2]), row[3])
+                    self.hits += 1
+                    return CachedResponse(row[0], row[1], bytes(row[2]))
+            self.misses += 1
+            return None
+
+    def set(self, key, response):
+        '''
+        Store a successful response in the cache. Unsuccessful responses are ignored.
+        :param key: a key from Cache.key()
+        :param response: a requests response
+        '''
+        if not response.ok:
+            return
+        now = time.time()
+        expires = now + self.ttl if self.ttl is not None else None
+        content = response.content
+        with self._lock:
+            self._remember(key, response.url, response.status_code, content, expires)
+            if self._db is not None and len(content) <= self.max_bytes:
+                self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                 (key, response.url, response.status_code, content,
+                                  len(content), expires, now))
+                self._evict()
+                self._db.commit()
+
+    def _remember(self, key, url, status, content, expires):
+        '''
+        Add an entry to the in-memory tier, evicting the least recently used entries to stay
+        within memory_bytes.
+        '''
+        if len(content) > self.memory_bytes:
+            return
+        self._forget(key)
+        self._memory[key] = (url, status, content, expires)
+        self._memory_size += len(content)
+        while self._memory_size > self.memory_bytes:
+            self._forget(next(iter(self._memory)))
+
+    def _forget(self, key):
+        '''
+        Remove an entry from the in-memory tier, if it's there.
+        '''
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_size -= len(entry[2])
+
+    def _evict(self):
+        '''
+        Remove expired entries from the on-disk tier, then the least recently accessed ones until
+        it's within max_bytes.
+        '''
+        self._db.execute('DELETE FROM responses WHERE expires IS NOT NULL AND expires <= ?',
+                         (time.time(),))
+        size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if size <= self.max_bytes:
+            return
+        rows = self._db.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall()
+        removed = []
+        for key, entry_size in rows:
+            if size <= self.max_bytes:
+                break
+            removed.append((key,))
+            size -= entry_size
+        self._db.executemany('DELETE FROM responses WHERE key = ?', removed)
+        log.debug(f'Evicted {len(removed)} responses from the cache.')
+
+    def clear(self):
+        '''
+        Remove everything from the cache and reset the hit/miss counts.
+        '''
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            self.hits = 0
+            self.misses = 0
+            if self._db is not None:
+                self._db.execute('DELETE FROM responses')
+                self._db.commit()
+
+    def close(self):
+        '''
+        Close the on-disk tier.
+        '''
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
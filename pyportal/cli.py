@@ -0,0 +1,113 @@
+import argparse
+import json
+import logging
+import sys
+
+import requests
+
+from .api import API
+from .errors import CheckpointError, IncompleteResultsError, IncorrectURLError
+
+
+def parse_filters(filters):
+    '''
+    Convert filters from the command line, in the form field:value, into a dict.
+    :param filters: list of strings
+    :return: dict of filters
+    '''
+    parsed = {}
+    for f in filters or []:
+        if ':' not in f:
+            raise argparse.ArgumentTypeError(f'"{f}" is not in the form field:value.')
+        k, v = f.split(':', 1)
+        parsed[k] = v
+    return parsed
+
+
+def checkpointed_records(path):
+    '''
+    Get the number of records an export has saved, according to its checkpoint.
+    :param path: the path of the export's file
+    :return: int
+    '''
+    try:
+        with open(path + '.checkpoint', 'r') as f:
+            return json.load(f)['records']
+    except (OSError, ValueError, KeyError):
+        return 0
+
+
+def export(args):
+    '''
+    Run the export command.
+    :param args: parsed arguments
+    :return: exit code
+    '''
+    if args.source.startswith('http'):
+        params = API.from_url(args.source)
+    else:
+        params = {'resource_id': args.source}
+    params.update(parse_filters(args.filter))
+    if args.query is not None:
+        params['query'] = args.query
+    if args.sort:
+        params['sort'] = args.sort
+    if args.fields is not None:
+        params['fields'] = args.fields.split(',')
+    with API(args.api_key) as api:
+        try:
+            n = api.export(path=args.path, chunk_size=args.chunk_size, resume=args.resume,
+                           pagination=args.pagination, **params)
+        except requests.RequestException as e:
+            print(f'Error: {e}', file=sys.stderr)
+            print(f'{checkpointed_records(args.path)} records were saved to {args.path}; run the '
+                  f'same command with --resume to continue from there.', file=sys.stderr)
+            return 1
+    print(f'Exported {n} records to {args.path}.')
+    return 0
+
+
+def cli(argv=None):
+    '''
+    The pyportal command line entry point.
+    :param argv: list of arguments (defaults to sys.argv)
+    :return: exit code
+    '''
+    parser = argparse.ArgumentParser(prog='pyportal',
+                                     description='Work with the NHM Data Portal API.')
+    parser.add_argument('--api-key', help='an API key')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log progress')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    export_parser = commands.add_parser('export',
+                                        help='export records to a gzipped NDJSON file')
+    export_parser.add_argument('source', help='a resource ID, or a data portal search URL')
+    export_parser.add_argument('path', help='the file to write, e.g. records.ndjson.gz')
+    export_parser.add_argument('-f', '--filter', action='append',
+                               help='filter records, in the form field:value (repeatable)')
+    export_parser.add_argument('-q', '--query', help='free text search')
+    export_parser.add_argument('-s', '--sort', action='append',
+                               help='field and direction to sort by, e.g. "genus desc" '
+                                    '(repeatable)')
+    export_parser.add_argument('--fields', help='comma-separated list of fields to export')
+    export_parser.add_argument('--chunk-size', type=int, default=10000,
+                               help='number of records written between checkpoints')
+    export_parser.add_argument('--pagination', choices=['offset', 'cursor'], default='cursor',
+                               help='how to page through the records')
+    export_parser.add_argument('--resume', action='store_true',
+                               help='continue from where a previous export stopped')
+    export_parser.set_defaults(func=export)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    try:
+        return args.func(args)
+    except (argparse.ArgumentTypeError, CheckpointError, IncompleteResultsError,
+            IncorrectURLError) as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(cli())
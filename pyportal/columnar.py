@@ -0,0 +1,246 @@
+import json
+import logging
+from itertools import islice
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+log = logging.getLogger('pyportal')
+
+BOOL = 'bool'
+INT = 'int'
+FLOAT = 'float'
+STRING = 'string'
+
+formats = ['arrow', 'numpy']
+
+
+def infer_type(values):
+    '''
+    Work out the narrowest type that fits all the non-null values in a column.
+    :param values: list of values
+    :return: one of 'bool', 'int', 'float', 'string', or None if every value is null
+    '''
+    found = None
+    for v in values:
+        if v is None:
+            continue
+        if isinstance(v, bool):
+            t = BOOL
+        elif isinstance(v, int):
+            t = INT
+        elif isinstance(v, float):
+            t = FLOAT
+        else:
+            return STRING
+        found = t if found is None else widen(found, t)
+        if found == STRING:
+            return STRING
+    return found
+
+
+def widen(a, b):
+    '''
+    Get a type that fits the values of two column types.
+    :param a: a column type (or None if unknown)
+    :param b: a column type (or None if unknown)
+    :return: a column type (or None if both are unknown)
+    '''
+    if a is None or a == b:
+        return b
+    if b is None:
+        return a
+    if {a, b} == {INT, FLOAT}:
+        return FLOAT
+    return STRING
+
+
+def coerce(values, column_type):
+    '''
+    Convert the values of a column to the given type. Nested values (lists and dicts) are
+    JSON-encoded in string columns; values that can't be converted to a numeric or boolean type
+    become null.
+    :param values: list of values
+    :param column_type: the type to convert to
+    :return: tuple of (converted values, number of values that were nulled)
+    '''
+    converted = []
+    lost = 0
+    for v in values:
+        if v is None:
+            converted.append(None)
+        elif column_type == STRING:
+            converted.append(v if isinstance(v, str) else
+                             json.dumps(v) if isinstance(v, (dict, list)) else str(v))
+        else:
+            try:
+                if column_type == BOOL:
+                    if not isinstance(v, bool):
+                        raise ValueError
+                    converted.append(v)
+                elif column_type == INT:
+                    if isinstance(v, float) and not v.is_integer():
+                        raise ValueError
+                    converted.append(int(v))
+                else:
+                    converted.append(float(v))
+            except (TypeError, ValueError):
+                converted.append(None)
+                lost += 1
+    return converted, lost
+
+
+class BatchBuilder(object):
+    def __init__(self, columns=None, fmt='arrow', schema=None):
+        '''
+        Turns lists of records into column-oriented batches, keeping column types consistent from
+        one batch to the next: a column's type is inferred from its values, widened (e.g. int to
+        float, or anything to string) when later batches don't fit it, and a column that's
+        entirely null stays untyped until a batch has values for it.
+        :param columns: list of column names; if None, the fields of the first batch are used
+        :param fmt: 'arrow' for pyarrow RecordBatches, or 'numpy' for dicts of NumPy arrays
+        :param schema: a pyarrow schema to use instead of inferring types (optional)
+        '''
+        if fmt not in formats:
+            raise ValueError(f'"{fmt}" is not a batch format; use one of {formats}.')
+        if fmt == 'arrow' and pa is None:
+            raise ImportError('pyarrow is required for Arrow batches: pip install pyarrow')
+        if fmt == 'numpy' and np is None:
+            raise ImportError('numpy is required for NumPy batches: pip install numpy')
+        self.fmt = fmt
+        self.schema = schema
+        self.columns = list(schema.names) if schema is not None else columns
+        self.types = {}
+        self.frozen = False
+
+    def freeze(self):
+        '''
+        Stop widening column types; values in later batches are converted to the types already
+        inferred (untyped columns become strings), and a ValueError is raised if they can't be.
+        Used when writing to a file, whose schema can't change after the first batch.
+        '''
+        self.frozen = True
+        for c in self.columns:
+            if self.types.get(c) is None:
+                self.types[c] = STRING
+
+    def _columns_for(self, records):
+        if self.columns is None:
+            self.columns = []
+            for record in records:
+                self.columns += [k for k in record if k not in self.columns]
+        return self.columns
+
+    def build(self, records):
+        '''
+        Make a batch from a list of records.
+        :param records: list of record dicts
+        :return: a pyarrow.RecordBatch or a dict of NumPy arrays, depending on the format
+        '''
+        columns = self._columns_for(records)
+        arrays = []
+        for c in columns:
+            values = [r.get(c) for r in records]
+            if self.schema is not None:
+                arrays.append(pa.array(values, type=self.schema.field(c).type))
+                continue
+            if not self.frozen:
+                self.types[c] = widen(self.types.get(c), infer_type(values))
+            values, lost = coerce(values, self.types[c] or STRING)
+            if lost > 0:
+                # only possible once frozen, as otherwise the type is widened to fit
+                raise ValueError(f'{lost} values in "{c}" are not {self.types[c]}, the type '
+                                 f'inferred from earlier batches; pass a schema to set the '
+                                 f'column types.')
+            arrays.append(self._array(values, self.types[c]))
+        if self.fmt == 'numpy':
+            return dict(zip(columns, arrays))
+        return pa.RecordBatch.from_arrays(arrays, names=columns)
+
+    def _array(self, values, column_type):
+        if self.fmt == 'arrow':
+            arrow_types = {
+                BOOL: pa.bool_(),
+                INT: pa.int64(),
+                FLOAT: pa.float64(),
+                STRING: pa.string(),
+                None: pa.null()
+                }
+            return pa.array(values, type=arrow_types[column_type])
+        has_nulls = any(v is None for v in values)
+        if column_type == FLOAT:
+            return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        if column_type in (INT, BOOL) and not has_nulls:
+            return np.array(values, dtype=np.int64 if column_type == INT else np.bool_)
+        # strings, and ints/bools with missing values, are kept as Python objects
+        return np.array(values, dtype=object)
+
+
+def iter_batches(records, columns=None, batch_size=10000, fmt='arrow', schema=None):
+    '''
+    Group an iterable of records into column-oriented batches.
+    :param records: iterable of record dicts
+    :param columns: list of column names; if None, the fields of the first batch are used
+    :param batch_size: maximum number of records in each batch
+    :param fmt: 'arrow' for pyarrow RecordBatches, or 'numpy' for dicts of NumPy arrays
+    :param schema: a pyarrow schema to use instead of inferring types (optional)
+    :return: generator that yields batches
+    '''
+    builder = BatchBuilder(columns, fmt, schema)
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, batch_size))
+        if len(chunk) == 0:
+            break
+        yield builder.build(chunk)
+
+
+def write_parquet(records, path, columns=None, batch_size=10000, schema=None,
+                  compression='snappy'):
+    '''
+    Write an iterable of records to a Parquet file, one row group per batch, so only one batch
+    is held in memory at a time. Column types are inferred from the first batch (columns that
+    are null throughout it become strings) unless a schema is given; as the file's schema can't
+    change, a ValueError is raised if a later batch has values that don't fit these types.
+    :param records: iterable of record dicts
+    :param path: the path of the file to write
+    :param columns: list of column names; if None, the fields of the first batch are used
+    :param batch_size: maximum number of records in each row group
+    :param schema: a pyarrow schema to use instead of inferring types (optional)
+    :param compression: the Parquet compression codec
+    :return: the number of records written
+    '''
+    if pq is None:
+        raise ImportError('pyarrow is required to write Parquet files: pip install pyarrow')
+    builder = BatchBuilder(columns, 'arrow', schema)
+    writer = None
+    written = 0
+    records = iter(records)
+    try:
+        while True:
+            chunk = list(islice(records, batch_size))
+            if len(chunk) == 0:
+                break
+            batch = builder.build(chunk)
+            if writer is None:
+                if schema is None:
+                    untyped = any(builder.types[c] is None for c in builder.columns)
+                    builder.freeze()
+                    if untyped:
+                        batch = builder.build(chunk)
+                writer = pq.ParquetWriter(path, batch.schema, compression=compression)
+            writer.write_table(pa.Table.from_batches([batch]))
+            written += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return written
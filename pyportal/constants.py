@@ -14,3 +14,4 @@ class resources:
 class URLs:
     base_url = 'https://data.nhm.ac.uk/api/3'
     asset_url = 'https://www.nhm.ac.uk/services/media-store/asset/{0}/contents/preview'
+    asset_original_url = 'https://www.nhm.ac.uk/services/media-store/asset/{0}/contents/original'
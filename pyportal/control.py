@@ -0,0 +1,191 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+
+import requests
+
+log = logging.getLogger('pyportal')
+
+# statuses that mean the request might succeed if it's tried again later
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+
+def retry_after(response):
+    '''
+    Read the Retry-After header from a response.
+    :param response: a response object (or None)
+    :return: the number of seconds to wait, or None if the header isn't there or can't be read
+    '''
+    value = response.headers.get('Retry-After') if response is not None else None
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(when.timestamp() - time.time(), 0.0)
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=None):
+        '''
+        A thread-safe token bucket that limits how often requests can be made. The rate is
+        halved whenever the server says requests are too frequent, and recovers gradually as
+        requests succeed.
+        :param rate: maximum number of requests per second
+        :param burst: maximum number of requests that can be made at once after a quiet period
+                      (optional; defaults to the rate, or 1 if that's lower)
+        '''
+        self.max_rate = rate
+        self.min_rate = rate / 16
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        '''
+        Wait until a request can be made.
+        '''
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+        log.debug(f'Request rate reduced to {self.rate:.2f}/s.')
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+
+class PageSizer(object):
+    def __init__(self, limit=1000, minimum=100, maximum=10000, target_latency=2.0):
+        '''
+        Adjusts the number of records requested per page: the limit doubles while pages come
+        back well within the target time, and halves when they're slow or fail.
+        :param limit: the starting limit
+        :param minimum: the smallest limit to use
+        :param maximum: the largest limit to use
+        :param target_latency: the number of seconds a page should take
+        '''
+        self.limit = limit
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+
+    def observe(self, latency):
+        '''
+        Adjust the limit after a page has been received.
+        :param latency: the number of seconds the page took
+        '''
+        if latency < self.target_latency / 2:
+            self.limit = min(self.maximum, self.limit * 2)
+        elif latency > self.target_latency:
+            self.limit = max(self.minimum, self.limit // 2)
+
+    def failed(self):
+        '''
+        Reduce the limit after a request has failed.
+        '''
+        self.limit = max(self.minimum, self.limit // 2)
+
+
+class RequestController(object):
+    def __init__(self, retries=3, backoff=0.5, max_backoff=60.0, rate_limit=None, burst=None,
+                 adaptive_limit=False, min_limit=100, max_limit=10000, target_latency=2.0):
+        '''
+        Controls how requests are sent: how fast, how failures are retried, and (optionally) how
+        many records are requested per page.
+        :param retries: how many times to retry a request that failed with a server error, a
+                        429, a timeout or a connection error
+        :param backoff: the base delay (in seconds) before the first retry; this doubles for
+                        each retry after that, with random jitter
+        :param max_backoff: the longest delay (in seconds) between retries, unless the server
+                            asks for a longer one with Retry-After
+        :param rate_limit: maximum number of requests per second (optional)
+        :param burst: maximum number of requests at once after a quiet period (optional)
+        :param adaptive_limit: if True, adjust the page size used by all() according to how
+                               long pages take (optional)
+        :param min_limit: the smallest page size when adapting (optional)
+        :param max_limit: the largest page size when adapting (optional)
+        :param target_latency: how long (in seconds) a page should take when adapting
+                               (optional)
+        '''
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = TokenBucket(rate_limit, burst) if rate_limit is not None else None
+        self.page_sizer = PageSizer(minimum=min_limit, maximum=max_limit,
+                                    target_latency=target_latency) if adaptive_limit else None
+
+    def delay(self, attempt, response=None):
+        '''
+        Work out how long to wait before retrying.
+        :param attempt: the number of the retry (starting at 0)
+        :param response: the failed response, if there was one (optional)
+        :return: the number of seconds to wait
+        '''
+        requested = retry_after(response)
+        if requested is not None:
+            return requested
+        ceiling = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    def send(self, request, on_retry=None):
+        '''
+        Make a request, waiting for the rate limit and retrying if it fails.
+        :param request: a function with no arguments that makes the request and returns the
+                        response
+        :param on_retry: a function called before each retry with the number of the retry
+                         (starting at 1), the delay before it in seconds, and the reason for it
+                         (optional)
+        :return: the response (which may still be unsuccessful, if all the retries failed)
+        '''
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                self.limiter.acquire()
+            response = None
+            try:
+                response = request()
+                if response.status_code not in RETRY_STATUSES:
+                    if self.limiter is not None:
+                        self.limiter.succeeded()
+                    return response
+                reason = f'{response.status_code} {response.reason}'
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.retries:
+                    raise
+                reason = str(e)
+            if response is not None and response.status_code == 429 and \
+                    self.limiter is not None:
+                self.limiter.throttled()
+            if self.page_sizer is not None:
+                self.page_sizer.failed()
+            if attempt >= self.retries:
+                return response
+            wait = self.delay(attempt, response)
+            log.warning(f'Request failed ({reason}); retrying in {wait:.1f}s.')
+            if response is not None:
+                response.close()
+            attempt += 1
+            if on_retry is not None:
+                on_retry(attempt, wait, reason)
+            time.sleep(wait)
@@ -0,0 +1,108 @@
+import io
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+log = logging.getLogger('pyportal')
+
+RECORDS_PREFIX = 'result.records.item'
+
+
+def loads(data):
+    '''
+    Decode a JSON document, using orjson if it's installed.
+    :param data: the document, as bytes or str
+    :return: the decoded object
+    '''
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _reader(response):
+    '''
+    Get a file-like object that reads the (decompressed) body of a response as it arrives.
+    :param response: a response object, ideally requested with stream=True
+    :return: a file-like object
+    '''
+    raw = getattr(response, 'raw', None)
+    if raw is not None and hasattr(raw, 'read'):
+        raw.decode_content = True
+        return raw
+    return io.BytesIO(response.content)
+
+
+class StreamedPage(object):
+    def __init__(self, response):
+        '''
+        Decodes the records in a datastore_search response one at a time as the body is read,
+        so that the raw body, the whole decoded page and the records never all have to be in
+        memory together. Uses ijson if it's installed; otherwise the body is decoded in one go
+        and the records are yielded from that.
+        :param response: a response object, ideally requested with stream=True
+        '''
+        self.response = response
+        self.success = False
+        # everything in 'result' apart from the records, e.g. total, after; total is available
+        # as soon as it's been read, which is usually before the first record
+        self.result = {}
+
+    def __iter__(self):
+        if ijson is None:
+            return self._decoded()
+        return self._streamed()
+
+    def _decoded(self):
+        body = loads(self.response.content)
+        self.success = body.get('success', False)
+        result = body.get('result') or {}
+        records = result.pop('records', None) or []
+        self.result = result
+        del body, result
+        # pop records off the list so that each one is only referenced by the consumer
+        records.reverse()
+        while records:
+            yield records.pop()
+
+    def _streamed(self):
+        builder = None
+        meta_key = None
+        meta_builder = None
+        for prefix, event, value in ijson.parse(_reader(self.response), use_float=True):
+            if builder is not None:
+                builder.event(event, value)
+                if prefix == RECORDS_PREFIX and event in ('end_map', 'end_array'):
+                    yield builder.value
+                    builder = None
+            elif prefix == RECORDS_PREFIX:
+                if event in ('start_map', 'start_array'):
+                    builder = ijson.ObjectBuilder()
+                    builder.event(event, value)
+                else:
+                    yield value
+            elif meta_builder is not None:
+                meta_builder.event(event, value)
+                if prefix == f'result.{meta_key}' and event in ('end_map', 'end_array'):
+                    self.result[meta_key] = meta_builder.value
+                    meta_builder = None
+            elif prefix == 'success':
+                self.success = value
+            elif prefix.startswith('result.') and prefix.count('.') == 1 and event != 'map_key':
+                key = prefix.split('.', 1)[1]
+                if key == 'records':
+                    continue
+                if event in ('start_map', 'start_array'):
+                    meta_key = key
+                    meta_builder = ijson.ObjectBuilder()
+                    meta_builder.event(event, value)
+                else:
+                    self.result[key] = value
@@ -0,0 +1,230 @@
+import logging
+import mimetypes
+import os
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .constants import URLs
+
+log = logging.getLogger('pyportal')
+
+asset_urls = {
+    'preview': URLs.asset_url,
+    'original': URLs.asset_original_url
+    }
+
+
+class DownloadStats(object):
+    def __init__(self):
+        '''
+        Running totals for a batch of asset downloads.
+        '''
+        self.started = time.perf_counter()
+        self.finished = None
+        self.images = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def add(self, images=0, nbytes=0, skipped=0, failed=0):
+        with self._lock:
+            self.images += images
+            self.bytes += nbytes
+            self.skipped += skipped
+            self.failed += failed
+
+    @property
+    def elapsed(self):
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return end - self.started
+
+    @property
+    def bytes_per_second(self):
+        return self.bytes / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def images_per_second(self):
+        return self.images / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self):
+        return f'{self.images} images ({self.bytes} bytes) downloaded in {self.elapsed:.1f}s ' \
+               f'[{self.images_per_second:.1f} images/s, {self.bytes_per_second:.0f} bytes/s], ' \
+               f'{self.skipped} skipped, {self.failed} failed'
+
+
+class AssetDownloader(object):
+    def __init__(self, session, dest, size='preview', workers=8, per_host=4,
+                 chunk_size=64 * 1024, report_every=100):
+        '''
+        Downloads asset files concurrently, streaming each one to disk in chunks.
+        :param session: a pyportal Session to make requests through
+        :param dest: the directory to save files in (created if it doesn't exist)
+        :param size: 'preview' or 'original'
+        :param workers: number of files to download at once
+        :param per_host: maximum number of downloads at once from any one host
+        :param chunk_size: number of bytes to read and write at a time
+        :param report_every: log progress after every n images (optional)
+        '''
+        if size not in asset_urls:
+            raise ValueError(f'"{size}" is not an asset size; use one of {list(asset_urls)}.')
+        self.session = session
+        self.dest = dest
+        self.size = size
+        self.workers = workers
+        self.per_host = per_host
+        self.chunk_size = chunk_size
+        self.report_every = report_every
+        self.stats = DownloadStats()
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+
+    def _host_slot(self, url):
+        '''
+        Get the semaphore that limits concurrent downloads from the URL's host.
+        :param url: the URL to be downloaded
+        :return: a threading.Semaphore
+        '''
+        host = urllib.parse.urlparse(url).hostname
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.Semaphore(self.per_host)
+            return self._hosts[host]
+
+    def target(self, media):
+        '''
+        Work out where to download an asset from and where to save it.
+        :param media: an asset dict from a record's associatedMedia
+        :return: a tuple of (url, file path), or None if the asset has no ID
+        '''
+        asset_id = media.get('assetID')
+        if asset_id is None:
+            return None
+        if self.size == 'preview':
+            ext = '.jpg'
+        else:
+            ext = mimetypes.guess_extension(media.get('mime') or '') or ''
+        url = asset_urls[self.size].format(asset_id)
+        return url, os.path.join(self.dest, f'{asset_id}{ext}')
+
+    def _is_complete(self, url, path):
+        '''
+        Check whether a file has already been downloaded, i.e. it exists and matches the size
+        reported by the server (if it reports one). If the size can't be checked because the
+        request fails or the size isn't a number, the file is downloaded again.
+        :param url: the URL the file is downloaded from
+        :param path: the path of the file
+        :return: True if the file is complete
+        '''
+        if not os.path.exists(path):
+            return False
+        try:
+            with self._host_slot(url):
+                r = self.session.head(url, allow_redirects=True)
+        except requests.RequestException as e:
+            log.debug(f'Could not check the size of {url}: {e}')
+            return False
+        if not r.ok:
+            log.debug(f'Could not check the size of {url} ({r.status_code}).')
+            return False
+        expected = r.headers.get('Content-Length')
+        if expected is None:
+            return True
+        try:
+            return int(expected) == os.path.getsize(path)
+        except ValueError:
+            log.debug(f'Could not check the size of {url} (Content-Length: {expected}).')
+            return False
+
+    def download(self, url, path):
+        '''
+        Download a single file. Data is streamed to a .part file which is renamed once it's
+        complete; if a .part file is already there, the download resumes from where it stopped.
+        :param url: the URL to download
+        :param path: the path to save the file as
+        :return: the number of bytes downloaded, or None if the file was skipped
+        '''
+        if self._is_complete(url, path):
+            return None
+        partial = path + '.part'
+        done = os.path.getsize(partial) if os.path.exists(partial) else 0
+        headers = {'Range': f'bytes={done}-'} if done > 0 else None
+        nbytes = 0
+        with self._host_slot(url):
+            r = self.session.get(url, headers=headers, stream=True)
+            try:
+                # a range starting at the end of the file means the .part file is already complete
+                complete = r.status_code == 416 and done > 0
+                if not r.ok and not complete:
+                    log.error(f'HTTP request failed ({r.status_code}) for {url}.')
+                    raise requests.HTTPError(response=r)
+                if not complete:
+                    # the server might ignore the range and send the whole file again
+                    mode = 'ab' if r.status_code == 206 else 'wb'
+                    with open(partial, mode) as f:
+                        for chunk in r.iter_content(chunk_size=self.chunk_size):
+                            f.write(chunk)
+                            nbytes += len(chunk)
+            finally:
+                r.close()
+        os.replace(partial, path)
+        return nbytes
+
+    def _download(self, url, path, slots):
+        '''
+        Download a single file in a worker thread, adding the outcome to the stats. Errors are
+        logged and counted as failures rather than raised, as the executor would lose them.
+        :param url: the URL to download
+        :param path: the path to save the file as
+        :param slots: the semaphore limiting how many assets are waiting; released when done
+        '''
+        try:
+            nbytes = self.download(url, path)
+            if nbytes is None:
+                self.stats.add(skipped=1)
+            else:
+                self.stats.add(images=1, nbytes=nbytes)
+                if self.report_every and self.stats.images % self.report_every == 0:
+                    log.info(str(self.stats))
+        except (requests.RequestException, OSError) as e:
+            log.error(f'Could not download {url}: {e}')
+            self.stats.add(failed=1)
+        except Exception:
+            # anything else would be lost in the executor, so it's logged and counted here
+            log.exception(f'Could not download {url}.')
+            self.stats.add(failed=1)
+        finally:
+            slots.release()
+
+    def run(self, assets):
+        '''
+        Download every asset from an iterable of (record_id, media) tuples, e.g. from
+        AssetIterator.all(). Assets are read from the iterable only as fast as they're
+        downloaded, so the number waiting in memory stays bounded.
+        :param assets: iterable of (record_id, media) tuples, where media is an asset dict or a
+                       list of them
+        :return: a DownloadStats instance
+        '''
+        os.makedirs(self.dest, exist_ok=True)
+        slots = threading.BoundedSemaphore(self.workers * 2)
+        seen = set()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for record_id, media in assets:
+                for item in (media if isinstance(media, list) else [media]):
+                    target = self.target(item or {})
+                    if target is None:
+                        log.debug(f'Asset without an ID on record {record_id}.')
+                        continue
+                    # the same asset can be attached to more than one record
+                    if target[1] in seen:
+                        continue
+                    seen.add(target[1])
+                    slots.acquire()
+                    executor.submit(self._download, *target, slots)
+        self.stats.finished = time.perf_counter()
+        log.info(str(self.stats))
+        return self.stats
@@ -20,13 +20,21 @@ class Endpoint(object):
         :param optional_params: names of parameters that can be optionally included in a request
         '''
         self.endpoint = endpoint
-        self.url = URLs.base_url + '/action/' + endpoint
+        self.url = self.url_for(URLs.base_url)
         self.requires_auth = requires_auth
         self.has_records = has_records
         self.has_assets = has_assets
         self.required_params = required_params or []
         self.optional_params = optional_params or []
 
+    def url_for(self, base_url):
+        '''
+        Get the URL for this endpoint on a particular API.
+        :param base_url: the base URL of the API, e.g. https://data.nhm.ac.uk/api/3
+        :return: the URL
+        '''
+        return base_url.rstrip('/') + '/action/' + self.endpoint
+
     def format_params(self, **params):
         '''
         Ensure the passed parameters fit the required/optional parameters for this endpoint.
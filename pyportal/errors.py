@@ -4,3 +4,11 @@ class ParameterMissingError(Exception):
 
 class IncorrectURLError(Exception):
     pass
+
+
+class IncompleteResultsError(Exception):
+    pass
+
+
+class CheckpointError(Exception):
+    pass
@@ -0,0 +1,146 @@
+import gzip
+import json
+import logging
+import os
+
+from .errors import CheckpointError, IncompleteResultsError
+
+log = logging.getLogger('pyportal')
+
+# request parameters that change from page to page, so aren't part of the query itself
+PAGE_PARAMS = ['offset', 'limit', 'after']
+
+
+class Exporter(object):
+    def __init__(self, search, path, chunk_size=10000, page_size=1000):
+        '''
+        Writes every record from a search to a gzip-compressed NDJSON file (one JSON record per
+        line), saving a checkpoint each time a chunk of records is written so an interrupted
+        export can be resumed.
+        :param search: a ResultsIterator
+        :param path: the path of the file to write
+        :param chunk_size: write (and checkpoint) after at least this many records
+        :param page_size: number of records to request per page
+        '''
+        self.search = search
+        self.path = path
+        self.checkpoint_path = path + '.checkpoint'
+        self.chunk_size = chunk_size
+        self.page_size = page_size
+        self.start = search.offset
+        # where the search had got to after the last page that was read
+        self.offset = search.offset
+        self.after = None
+        self.records = 0
+        self.bytes = 0
+        self.query = {k: v for k, v in search.params.items() if k not in PAGE_PARAMS}
+
+    def load_checkpoint(self):
+        '''
+        Read the checkpoint for this export, if there is one.
+        :return: the checkpoint dict, or None
+        '''
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path, 'r') as f:
+            checkpoint = json.load(f)
+        if checkpoint['url'] != self.search.url or checkpoint['query'] != self.query:
+            raise CheckpointError(f'{self.checkpoint_path} is for a different search; delete it '
+                                  f'or export to another path.')
+        return checkpoint
+
+    def save_checkpoint(self, complete=False):
+        '''
+        Record how far the export has got. The checkpoint is replaced atomically, so it always
+        matches data that's already on disk.
+        :param complete: whether the export has finished and been verified
+        '''
+        checkpoint = {
+            'url': self.search.url,
+            'query': self.query,
+            'pagination': self.search.pagination,
+            'start': self.start,
+            'offset': self.offset,
+            'after': self.after,
+            'records': self.records,
+            'bytes': self.bytes,
+            'complete': complete
+            }
+        temp_path = self.checkpoint_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(checkpoint, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.checkpoint_path)
+
+    def _restore(self, checkpoint):
+        '''
+        Continue from a checkpoint: drop anything written after it, then move the search to
+        where it was.
+        '''
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size < checkpoint['bytes']:
+            raise CheckpointError(f'{self.path} is smaller than its checkpoint says it should be.')
+        with open(self.path, 'ab') as f:
+            f.truncate(checkpoint['bytes'])
+        self.start = checkpoint['start']
+        self.records = checkpoint['records']
+        self.bytes = checkpoint['bytes']
+        self.offset = self.search.offset = checkpoint['offset']
+        self.after = self.search.after = checkpoint['after']
+        log.info(f'Resuming export to {self.path} after {self.records} records.')
+
+    def _write(self, lines):
+        '''
+        Append a chunk of lines to the file as a new gzip member, then checkpoint.
+        :param lines: list of encoded lines
+        '''
+        with open(self.path, 'ab') as f:
+            with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+                gz.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+            self.bytes = f.tell()
+        self.save_checkpoint()
+        log.info(f'Exported {self.records} records to {self.path}.')
+
+    def run(self, resume=False):
+        '''
+        Export all the records, then check the number written against the search's count.
+        :param resume: continue from the checkpoint if there is one (optional)
+        :return: the number of records exported
+        '''
+        checkpoint = self.load_checkpoint() if resume else None
+        if checkpoint is not None and checkpoint['complete']:
+            log.info(f'{self.path} is already complete.')
+            return checkpoint['records']
+        if checkpoint is not None:
+            self._restore(checkpoint)
+        else:
+            open(self.path, 'wb').close()
+            self.save_checkpoint()
+
+        self.search.raise_errors = True
+        self.search.params['limit'] = self.page_size
+        lines = []
+        while True:
+            try:
+                page = self.search.next()
+            except StopIteration:
+                break
+            lines += [(json.dumps(record) + '\n').encode('utf-8') for record in page]
+            self.records += len(page)
+            self.offset = self.search.offset
+            self.after = self.search.after
+            if len(lines) >= self.chunk_size:
+                self._write(lines)
+                lines = []
+        if len(lines) > 0:
+            self._write(lines)
+
+        expected = max(self.search.count() - self.start, 0)
+        if self.records != expected:
+            raise IncompleteResultsError(f'Exported {self.records} records but the search has '
+                                         f'{expected}.')
+        self.save_checkpoint(complete=True)
+        return self.records
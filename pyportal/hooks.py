@@ -0,0 +1,59 @@
+import logging
+
+log = logging.getLogger('pyportal')
+
+# on_request_start(url, params)
+# on_request_end(url, params, status, elapsed, bytes, cached)
+# on_page_decoded(url, records, elapsed)
+# on_retry(url, attempt, wait, reason)
+events = ['on_request_start', 'on_request_end', 'on_page_decoded', 'on_retry']
+
+
+class Hooks(object):
+    def __init__(self):
+        '''
+        Functions to call when things happen while a search runs. Each is called with keyword
+        arguments describing the event (see the list of events above); exceptions raised by a
+        hook are logged and otherwise ignored.
+        '''
+        self._hooks = {e: [] for e in events}
+
+    def _check(self, event):
+        '''
+        Make sure an event is one of the hooks that can be added.
+        :param event: the name of the event
+        '''
+        if event not in self._hooks:
+            raise ValueError(f'"{event}" is not a hook; use one of {events}.')
+
+    def add(self, event, hook):
+        '''
+        Call a function whenever an event happens.
+        :param event: the name of the event, e.g. 'on_request_end'
+        :param hook: the function to call
+        :return: the function
+        '''
+        self._check(event)
+        self._hooks[event].append(hook)
+        return hook
+
+    def remove(self, event, hook):
+        '''
+        Stop calling a function when an event happens.
+        :param event: the name of the event, e.g. 'on_request_end'
+        :param hook: the function to remove
+        '''
+        self._check(event)
+        self._hooks[event].remove(hook)
+
+    def fire(self, event, **info):
+        '''
+        Call all the functions registered for an event.
+        :param event: the name of the event
+        :param info: details of the event
+        '''
+        for hook in self._hooks[event]:
+            try:
+                hook(**info)
+            except Exception:
+                log.exception(f'Error in {event} hook.')
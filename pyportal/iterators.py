@@ -1,25 +1,67 @@
 import json
 import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
 import requests
 
+from . import columnar, pagination as paging, rows, sharding
+from .decoding import StreamedPage, loads
+from .errors import IncompleteResultsError
+from .session import Session, response_size
+from .stats import SearchStats
+
 log = logging.getLogger('pyportal')
 
+# the columns of asset batches
+ASSET_COLUMNS = ['record_id', 'media']
+
 
 class ResultsIterator(object):
-    def __init__(self, url, auth=None, offset=0, **params):
+    def __init__(self, url, auth=None, offset=0, session=None, pagination=paging.OFFSET,
+                 raise_errors=False, compact=False, **params):
         '''
         :param url: the API URL to request results from
         :param auth: an API key (optional)
         :param offset: skip n records (optional)
+        :param session: a pyportal Session to make requests through (optional; a new one is
+                        created if not provided)
+        :param pagination: 'offset' to page by increasing the offset, or 'cursor' to continue
+                           each page from the end of the last one (optional)
+        :param raise_errors: if True, failed requests raise an HTTPError from next() instead of
+                             ending the iteration as if there were no more results (optional)
+        :param compact: if True, records are returned as compact, read-only Row objects rather
+                        than dicts, which use much less memory (optional)
         :param params: parameters to send with the API request (e.g. filters, query etc)
         '''
+        if pagination not in paging.strategies:
+            raise ValueError(f'"{pagination}" is not a pagination strategy; use one of '
+                             f'{paging.strategies}.')
         self.url = url
         self.offset = offset
         self._original_offset = offset
         self.params = params
         self._original_params = params
         self.auth = auth
+        self.session = session if session is not None else Session()
+        self.pagination = pagination
+        self.raise_errors = raise_errors
+        self.compact = compact
+        self._rows = rows.RowFactory() if compact else None
+        self.after = None
+        self._finished = False
+        # set to False to bypass the session's cache, if it has one
+        self.use_cache = True
+        self.stats = SearchStats()
+        # the fields asked for, as sharding may need to request more
+        self.fields = list(params['fields']) if params.get('fields') else None
+        self._field_set = set(self.fields) if self.fields is not None else None
+        if pagination == paging.CURSOR:
+            self.params['sort'] = paging.keyset_sort(self.params.get('sort'))
 
     @classmethod
     def get_result(cls, response):
@@ -28,70 +70,457 @@ class ResultsIterator(object):
         :param response: a response object
         :return: either the 'result' dict, or None if no result is returned
         '''
-        j = response.json()
-        no_results = j.get('result', None) is None
-        if response.ok and j.get('success', False) and not no_results:
-            return j.get('result', j)
+        return cls.parse_result(loads(response.content), response.ok)
+
+    @classmethod
+    def parse_result(cls, body, ok=True):
+        '''
+        Retrieve a result from a decoded response body.
+        :param body: the decoded JSON body of the response
+        :param ok: whether the HTTP request itself succeeded
+        :return: either the 'result' dict, or None if no result is returned
+        '''
+        no_results = body.get('result', None) is None
+        if ok and body.get('success', False) and not no_results:
+            return body.get('result', body)
         else:
             return None
 
-    def _get(self):
+    def _get(self, stream=False):
         '''
         Make the API request.
+        :param stream: whether to defer downloading the response body until it's read
+        :return: the response object
+        '''
+        if self.after is None:
+            self.params['offset'] = self.offset
+        else:
+            # the continuation token already skips everything before this page
+            self.params['offset'] = 0
+            self.params['after'] = json.dumps(self.after)
+        return self._request(self.params, stream=stream)
+
+    def _request(self, params, stream=False):
+        '''
+        Make an API request with the given parameters.
+        :param params: the full set of parameters to send
+        :param stream: whether to defer downloading the response body until it's read
         :return: the response object
         '''
-        self.params['offset'] = self.offset
         headers = {
             'Authorization': self.auth
             } if self.auth is not None else {}
-        r = requests.get(self.url, headers=headers, params=self.params)
+        started = time.perf_counter()
+        r = self.session.get(self.url, headers=headers, params=params, stream=stream,
+                             cache=self.use_cache)
+        self.stats.request(time.perf_counter() - started, response_size(r, stream),
+                           getattr(r, 'from_cache', False))
         if not r.ok:
             log.error(f'HTTP request failed ({r.status_code}) for {self.url}.')
             log.error(r.reason)
-            raise requests.HTTPError
+            raise requests.HTTPError(f'{r.status_code} {r.reason}', response=r)
         return r
 
+    def _probe(self, limit=0, **params):
+        '''
+        Make a one-off request for a variant of this search, without changing the state of the
+        iterator. By default no records are requested, just the total.
+        :param limit: the number of records to request
+        :param params: parameters to change, e.g. offset, sort or filters
+        :return: the 'result' dict (empty if there isn't one)
+        '''
+        params = dict(self.params, offset=params.pop('offset', 0), limit=limit, **params)
+        params.pop('after', None)
+        result = self.get_result(self._request(params))
+        return result if result is not None else {}
+
     def _reset(self):
         '''
         Reset the iterator to its construction state.
         '''
         self.offset = self._original_offset
         self.params = self._original_params
+        self.params.pop('after', None)
+        self.after = None
+        self._finished = False
+
+    def _continue(self, result):
+        '''
+        Set up a cursor search to carry on after a page, using the continuation token returned
+        with it. A page without a token is the last one if it was itself requested with a token;
+        otherwise the server doesn't return tokens (and so won't understand them either), and
+        the search continues by offset instead.
+        :param result: the 'result' dict for the page
+        '''
+        after = result.get('after')
+        if after is not None:
+            self.after = after
+        elif self.after is None and self.offset < result.get('total', 0):
+            log.warning(f'No continuation token was returned by {self.url}; continuing the '
+                        f'search by offset instead.')
+            self.pagination = paging.OFFSET
+        else:
+            self._finished = True
 
     def next(self):
         '''
         Get the next 'page' of results, then set the new offset for the following page. Raises
         StopIteration if there's no more results.
-        :return: list of records
+        :return: list of records (or what they're converted into, e.g. Rows or asset tuples)
         '''
+        if self._finished:
+            self._reset()
+            raise StopIteration
         try:
             r = self._get()
         except requests.HTTPError:
+            if self.raise_errors:
+                raise
             self._reset()
             raise StopIteration
-        result = self.get_result(r)
-        no_records = result is None or 'records' not in result
-        end_of_queue = self.offset >= result.get('total', 0)
-        if result is None or no_records or end_of_queue:
+        result = self._decode(r)
+        no_records = result is None or len(result.get('records') or []) == 0
+        end_of_queue = result is None or self.offset >= result.get('total', 0)
+        if no_records or end_of_queue:
             log.debug('Nothing else in queue.')
             self._reset()
             raise StopIteration
         else:
             self.offset += len(result['records'])
-            return result['records']
+            if self.pagination == paging.CURSOR:
+                self._continue(result)
+            return [self._convert(record) for record in result['records']]
+
+    def _get_page(self, offset, limit):
+        '''
+        Get the page of records starting at the given offset, without changing the state of the
+        iterator. Safe to call from several threads at once.
+        :param offset: skip n records
+        :param limit: number of records in the page
+        :return: list of records (empty if there are none)
+        '''
+        r = self._request(dict(self.params, offset=offset, limit=limit))
+        result = self._decode(r)
+        if result is None:
+            return []
+        return result.get('records', [])
 
-    def all(self):
+    def _decode(self, response):
+        '''
+        Decode a page, recording how long it took.
+        :param response: the response object
+        :return: either the 'result' dict, or None if no result is returned
+        '''
+        started = time.perf_counter()
+        result = self.get_result(response)
+        records = len(result.get('records') or []) if result is not None else 0
+        self._decoded(records, time.perf_counter() - started)
+        return result
+
+    def _decoded(self, records, elapsed):
+        '''
+        Record that a page has been decoded, and tell any hooks.
+        :param records: the number of records in the page
+        :param elapsed: how long decoding took
+        '''
+        self.stats.page(records, elapsed)
+        hooks = getattr(self.session, 'hooks', None)
+        if hooks is not None:
+            hooks.fire('on_page_decoded', url=self.url, records=records, elapsed=elapsed)
+
+    def _convert(self, record):
+        '''
+        Convert a record from the API into the item returned by next() and all().
+        :param record: a record dict
+        :return: the record, or a Row in compact mode
+        '''
+        record = self._trim(record)
+        return self._rows.row(record) if self.compact else record
+
+    def _trim(self, record):
+        '''
+        Remove any fields that were only requested for paging, not asked for.
+        :param record: a record dict
+        :return: the record, with only the fields asked for
+        '''
+        fields = self._field_set
+        if fields is None or all(k in fields for k in record):
+            return record
+        return {k: v for k, v in record.items() if k in fields}
+
+    def all(self, workers=None, prefetch=None, stream=False, shards=None,
+            shard_by=paging.KEY_FIELD, shard_values=None):
         '''
         A generator that paginates automatically and yields individual records.
+        :param workers: if set, fetch upcoming pages on a pool of this many threads while the
+                        current page is being consumed; with shards, the number of shards
+                        fetched at once (optional)
+        :param prefetch: maximum number of pages to fetch ahead of the current one; defaults to
+                         twice the number of workers if only workers is set (optional)
+        :param stream: if True, decode each record as the page is downloaded instead of decoding
+                       the whole page first, which uses much less memory per page; install ijson
+                       to get the full benefit (optional)
+        :param shards: if set, split the search into this many parts and fetch them in
+                       parallel; records are yielded in no particular order, and the number
+                       yielded is checked against the search's count (optional)
+        :param shard_by: the field to split the search on: '_id' (the default) for ranges of
+                         _ids, or the name of a field whose values are given in shard_values
+                         (optional)
+        :param shard_values: every value of the shard_by field in the search (optional)
         :return: generator that yields dicts
         '''
         self.params['limit'] = 1000
+        if shards is not None:
+            if prefetch is not None or stream:
+                raise ValueError('Sharded searches cannot be prefetched or streamed.')
+            yield from self._sharded(shards, shard_by, shard_values, workers or shards)
+            return
+        if workers is not None or prefetch is not None:
+            if self.pagination != paging.OFFSET:
+                raise ValueError('Prefetching pages requires offset pagination.')
+            if stream:
+                raise ValueError('Prefetched pages cannot be streamed.')
+            workers = workers or 4
+            prefetch = prefetch or workers * 2
+            yield from self._prefetched(workers, prefetch)
+            return
+        if stream:
+            yield from self._streamed()
+            return
+        sizer = self._page_sizer()
         while True:
+            started = time.perf_counter()
             try:
-                for record in self.next():
-                    yield record
+                page = self.next()
             except StopIteration:
                 break
+            if sizer is not None:
+                sizer.observe(time.perf_counter() - started)
+                self.params['limit'] = sizer.limit
+            paused = time.perf_counter()
+            for record in page:
+                yield record
+            self.stats.consumed(time.perf_counter() - paused)
+
+    def _page_sizer(self):
+        '''
+        Get the session's PageSizer, if adaptive page sizes are enabled, and start from its
+        current limit.
+        :return: a pyportal.control.PageSizer, or None
+        '''
+        sizer = getattr(self.session, 'page_sizer', None)
+        if sizer is not None:
+            self.params['limit'] = sizer.limit
+        return sizer
+
+    def _prefetched(self, workers, prefetch):
+        '''
+        Yields records in order while the following pages are fetched concurrently. At most
+        prefetch pages are held (or in flight) at any time; anything outstanding is cancelled if
+        the consumer stops early.
+        :param workers: number of threads to fetch pages on
+        :param prefetch: maximum number of pages to fetch ahead
+        :return: generator that yields dicts
+        '''
+        self._page_sizer()
+        start = self.offset
+        limit = self.params['limit']
+        try:
+            total = ResultsIterator.count(self)
+        except requests.HTTPError:
+            self._reset()
+            if self.raise_errors:
+                raise
+            return
+        offsets = iter(range(start, total, limit))
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            for offset in islice(offsets, prefetch):
+                pending.append(executor.submit(self._get_page, offset, limit))
+            while pending:
+                try:
+                    records = pending.popleft().result()
+                except requests.HTTPError:
+                    if self.raise_errors:
+                        raise
+                    break
+                offset = next(offsets, None)
+                if offset is not None:
+                    pending.append(executor.submit(self._get_page, offset, limit))
+                if len(records) == 0:
+                    log.debug('Nothing else in queue.')
+                    break
+                paused = time.perf_counter()
+                for record in records:
+                    yield self._convert(record)
+                self.stats.consumed(time.perf_counter() - paused)
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+            self._reset()
+
+    def _sharded(self, shards, shard_by, shard_values, workers):
+        '''
+        Yields records as they arrive from several parts of the search fetched in parallel,
+        then checks that every record in the search was yielded.
+        :param shards: the number of parts to split the search into
+        :param shard_by: '_id', or the name of the field given values for in shard_values
+        :param shard_values: the values of the shard_by field
+        :param workers: the number of parts to fetch at once
+        :return: generator that yields dicts
+        '''
+        if self.offset != 0:
+            raise ValueError('Sharded searches must start from the beginning.')
+        if shard_by != paging.KEY_FIELD and not shard_values:
+            raise ValueError(f'shard_values must be given to shard by "{shard_by}".')
+        self._reset()
+        total = self._probe().get('total', 0)
+        if shard_by == paging.KEY_FIELD:
+            plan = sharding.plan_id_shards(self, shards, total, workers)
+        else:
+            plan = sharding.plan_value_shards(self, shards, shard_by, shard_values, total,
+                                              workers)
+        log.debug(f'Fetching {total} records in {len(plan)} shards.')
+        self._reset()
+
+        # pages are passed back through a bounded queue, so shards can't get far ahead of the
+        # consumer; None marks the end of a shard
+        pages = queue.Queue(maxsize=workers * 2)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def fetch(shard):
+            try:
+                for page in self._shard_pages(shard, stop):
+                    put(page)
+            except Exception as e:
+                put(e)
+            put(None)
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = [executor.submit(fetch, shard) for shard in plan]
+        finished = 0
+        yielded = 0
+        try:
+            while finished < len(plan):
+                page = pages.get()
+                if page is None:
+                    finished += 1
+                    continue
+                if isinstance(page, Exception):
+                    raise page
+                paused = time.perf_counter()
+                for record in page:
+                    yield self._convert(record)
+                self.stats.consumed(time.perf_counter() - paused)
+                yielded += len(page)
+        finally:
+            stop.set()
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+        if yielded != total:
+            raise IncompleteResultsError(f'Got {yielded} records from {len(plan)} shards but '
+                                         f'the search has {total}.')
+
+    def _shard_pages(self, shard, stop):
+        '''
+        Get the pages of records in one shard of the search.
+        :param shard: a pyportal.sharding.Shard
+        :param stop: a threading.Event that's set if the pages are no longer needed
+        :return: generator that yields lists of records
+        '''
+        params = {k: v for k, v in self.params.items() if k not in ('offset', 'after')}
+        pagination = self.pagination
+        if shard.filters:
+            filters = dict(sharding.search_filters(self), **shard.filters)
+            params['filters'] = json.dumps(filters)
+        else:
+            # ranges of _ids are read in _id order, continuing from the end of the last range
+            params['sort'] = [f'{paging.KEY_FIELD} asc']
+            pagination = paging.CURSOR
+            # the _ids are needed to find the end of the range (they're removed, if they weren't
+            # asked for, when the records are yielded)
+            if params.get('fields'):
+                params['fields'] = paging.keyset_fields(params['fields'], params['sort'])
+        search = ResultsIterator(self.url, auth=self.auth, session=self.session,
+                                 pagination=pagination, raise_errors=True, **params)
+        search.stats = self.stats
+        search.use_cache = self.use_cache
+        search.after = [shard.lower] if shard.lower is not None else None
+        limit = params['limit']
+        remaining = shard.size
+        while not stop.is_set():
+            if shard.upper is not None and remaining is not None:
+                # ask for just enough records to reach the end of the range
+                search.params['limit'] = max(min(limit, remaining), 1)
+            try:
+                page = search.next()
+            except StopIteration:
+                return
+            if shard.upper is not None:
+                within = [r for r in page if r[paging.KEY_FIELD] <= shard.upper]
+                if len(within) > 0:
+                    yield within
+                if len(within) < len(page) or within[-1][paging.KEY_FIELD] == shard.upper:
+                    return
+                remaining -= len(within)
+            else:
+                yield page
+
+    def _streamed(self):
+        '''
+        Yields records one at a time as each page is downloaded and decoded.
+        :return: generator that yields dicts
+        '''
+        sizer = self._page_sizer()
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    r = self._get(stream=True)
+                except requests.HTTPError:
+                    if self.raise_errors:
+                        raise
+                    break
+                page = StreamedPage(r)
+                decoding = time.perf_counter()
+                n = 0
+                # time spent by the consumer shouldn't count towards how long the page took
+                waiting = 0
+                try:
+                    for record in page:
+                        n += 1
+                        paused = time.perf_counter()
+                        yield self._convert(record)
+                        waiting += time.perf_counter() - paused
+                finally:
+                    r.close()
+                # reading the body is interleaved with decoding it, so it's counted as decoding
+                self._decoded(n, time.perf_counter() - decoding - waiting)
+                self.stats.consumed(waiting)
+                if sizer is not None:
+                    sizer.observe(time.perf_counter() - started - waiting)
+                    self.params['limit'] = sizer.limit
+                if n == 0 or not page.success:
+                    log.debug('Nothing else in queue.')
+                    break
+                self.offset += n
+                if self.pagination == paging.CURSOR:
+                    self._continue(page.result)
+                if self._finished or self.offset >= page.result.get('total', 0):
+                    break
+        finally:
+            self._reset()
 
     def first(self):
         '''
@@ -106,31 +535,103 @@ class ResultsIterator(object):
 
     def count(self):
         '''
-        Returns a count of all records in the result set.
+        Returns a count of all records in the result set. Only the total is requested, not any
+        records.
         :return: int
         '''
         self._reset()
-        response = self._get()
-        return response.json().get('result', {}).get('total', 0) if response.ok else 0
+        return self._probe().get('total', 0)
+
+    def iter_batches(self, columns=None, batch_size=10000, fmt='arrow', schema=None,
+                     **kwargs):
+        '''
+        A generator that paginates automatically and yields column-oriented batches of records.
+        Column types are inferred from the values, and widened if later batches don't fit them.
+        :param columns: list of fields to include; defaults to the fields the search was created
+                        with, or all the fields in the first batch (optional)
+        :param batch_size: maximum number of records in each batch (optional)
+        :param fmt: 'arrow' for pyarrow RecordBatches, or 'numpy' for dicts of NumPy arrays
+                    (optional)
+        :param schema: a pyarrow schema to use instead of inferring types (optional)
+        :param kwargs: passed to all(), e.g. workers or stream
+        :return: generator that yields batches
+        '''
+        columns = columns or self.fields
+        return columnar.iter_batches(self.all(**kwargs), columns, batch_size, fmt, schema)
+
+    def to_parquet(self, path, columns=None, batch_size=10000, schema=None,
+                   compression='snappy', **kwargs):
+        '''
+        Write all the records to a Parquet file, one row group per batch as the pages arrive, so
+        memory use stays constant however many records there are. Column types are inferred from
+        the first batch unless a schema is given (if a later batch doesn't fit them, a ValueError
+        is raised, so pass a schema for fields whose values vary in type).
+        :param path: the path of the file to write
+        :param columns: list of fields to include; defaults to the fields the search was created
+                        with, or all the fields in the first batch (optional)
+        :param batch_size: maximum number of records in each row group (optional)
+        :param schema: a pyarrow schema to use instead of inferring types (optional)
+        :param compression: the Parquet compression codec (optional)
+        :param kwargs: passed to all(), e.g. workers or stream
+        :return: the number of records written
+        '''
+        columns = columns or self.fields
+        return columnar.write_parquet(self.all(**kwargs), path, columns, batch_size, schema,
+                                      compression)
 
 
 class AssetIterator(ResultsIterator):
-    def next(self):
+    def _convert(self, record):
         '''
-        Returns a list of record assets in the form (record_id, asset_dict). Does not group assets
-        together by record.
-        :return: list of tuples in the form (record_id, asset_dict)
-        '''
-        records = super(AssetIterator, self).next()
-        assets = []
-        for record in records:
-            media = record.get('associatedMedia')
-            media = json.loads(media) if isinstance(media, str) else media
-            assets += [(record.get('_id'), media)]
-        if len(assets) > 0:
-            return assets
-        else:
-            return self.next()
+        Convert a record into an asset tuple. Does not group assets together by record. In
+        compact mode, the assets are only decoded when they're used.
+        :param record: a record dict
+        :return: tuple in the form (record_id, list of asset dicts)
+        '''
+        return rows.to_asset(record, lazy=self.compact)
 
     def count(self):
         raise NotImplementedError
+
+    def _asset_rows(self, **kwargs):
+        '''
+        Get all the asset tuples as dicts with a record_id column and a media column holding
+        the record's assets as a JSON string.
+        :param kwargs: passed to all()
+        :return: generator that yields dicts
+        '''
+        for record_id, media in self.all(**kwargs):
+            if isinstance(media, rows.LazyJSON):
+                media = media.raw
+            elif media is not None:
+                media = json.dumps(media)
+            yield {'record_id': record_id, 'media': media}
+
+    def iter_batches(self, batch_size=10000, fmt='arrow', schema=None, **kwargs):
+        '''
+        A generator that paginates automatically and yields column-oriented batches of assets,
+        with one row per record: its _id as record_id, and its assets as a JSON string in
+        media.
+        :param batch_size: maximum number of records in each batch (optional)
+        :param fmt: 'arrow' for pyarrow RecordBatches, or 'numpy' for dicts of NumPy arrays
+                    (optional)
+        :param schema: a pyarrow schema to use instead of inferring types (optional)
+        :param kwargs: passed to all(), e.g. workers or stream
+        :return: generator that yields batches
+        '''
+        return columnar.iter_batches(self._asset_rows(**kwargs), ASSET_COLUMNS, batch_size,
+                                     fmt, schema)
+
+    def to_parquet(self, path, batch_size=10000, schema=None, compression='snappy', **kwargs):
+        '''
+        Write all the assets to a Parquet file, in the same columns as iter_batches(), one row
+        group per batch.
+        :param path: the path of the file to write
+        :param batch_size: maximum number of records in each row group (optional)
+        :param schema: a pyarrow schema to use instead of inferring types (optional)
+        :param compression: the Parquet compression codec (optional)
+        :param kwargs: passed to all(), e.g. workers or stream
+        :return: the number of records written
+        '''
+        return columnar.write_parquet(self._asset_rows(**kwargs), path, ASSET_COLUMNS,
+                                      batch_size, schema, compression)
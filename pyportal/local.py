@@ -0,0 +1,193 @@
+import json
+import logging
+import threading
+
+from . import pagination as paging
+from .api import BaseAPI
+from .cache import CachedResponse
+from .mirror import connect, field_expression, read_meta
+
+log = logging.getLogger('pyportal')
+
+
+def filter_values(value):
+    '''
+    Get the values a filter matches. Numbers also match the same number written as a string,
+    as most fields in the portal hold strings.
+    :param value: the filter value, or a list of them
+    :return: list of values
+    '''
+    values = []
+    for v in value if isinstance(value, list) else [value]:
+        if isinstance(v, bool):
+            values.append(int(v))
+        elif isinstance(v, (int, float)):
+            values += [v, str(v)]
+        else:
+            values.append(v)
+    return values
+
+
+class LocalSession(object):
+    def __init__(self, path):
+        '''
+        Answers datastore_search requests from a mirror made by pyportal.mirror.Mirror, with
+        responses that look like the portal's, so the usual iterators can be used to search it.
+        :param path: the path of the mirror's SQLite file
+        '''
+        self.path = path
+        self.db = connect(path)
+        self.resource_id = read_meta(self.db).get('resource_id')
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._version = None
+
+    def _where(self, filters, query):
+        '''
+        Build the WHERE clause for the filters and free text query of a search.
+        :return: tuple of (list of conditions, list of parameters)
+        '''
+        conditions = []
+        args = []
+        for field, value in filters.items():
+            if field == '_has_image':
+                media = field_expression('associatedMedia')
+                has_image = f"({media} IS NOT NULL AND {media} NOT IN ('', '[]'))"
+                conditions.append(has_image if value else f'NOT {has_image}')
+                continue
+            values = filter_values(value)
+            conditions.append(f'{field_expression(field)} IN ({", ".join("?" * len(values))})')
+            args += values
+        # a rough equivalent of the portal's full text search: every word in the query has to
+        # appear somewhere in the record
+        for word in (query or '').split():
+            escaped = word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            conditions.append("data LIKE ? ESCAPE '\\'")
+            args.append(f'%{escaped}%')
+        return conditions, args
+
+    def _total(self, conditions, args):
+        '''
+        Count the records matching a search. Counts are kept until the mirror changes, as every
+        page of a search needs one.
+        '''
+        version = self.db.execute('PRAGMA data_version').fetchone()[0]
+        if version != self._version:
+            self._totals = {}
+            self._version = version
+        key = (tuple(conditions), tuple(args))
+        if key not in self._totals:
+            where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+            self._totals[key] = self.db.execute(f'SELECT COUNT(*) FROM records {where}',
+                                                args).fetchone()[0]
+        return self._totals[key]
+
+    def search(self, params):
+        '''
+        Run a datastore_search request against the mirror.
+        :param params: the request parameters
+        :return: the response body, as bytes
+        '''
+        if params.get('resource_id') != self.resource_id:
+            raise ValueError(f'{self.path} is a mirror of {self.resource_id}, not '
+                             f'{params.get("resource_id")}.')
+        filters = params.get('filters') or {}
+        filters = json.loads(filters) if isinstance(filters, str) else filters
+        conditions, args = self._where(filters, params.get('q'))
+        total = self._total(conditions, args)
+
+        sort = [s.split() for s in params.get('sort') or []]
+        order = []
+        for s in sort:
+            direction = (s[1:] or ['asc'])[0].lower()
+            # directions are written into the SQL, so only these two are accepted
+            if not 1 <= len(s) <= 2 or direction not in ('asc', 'desc'):
+                raise ValueError(f'"{" ".join(s)}" is not a valid sort; use a field name, '
+                                 f'optionally followed by asc or desc.')
+            order.append((field_expression(s[0]), direction))
+        if 'after' in params:
+            # keyset pagination: only records that sort after the values in the token. Nulls
+            # sort first ascending and last descending (as in SQLite and the portal), and never
+            # match = or <, so they're handled separately
+            after = json.loads(params['after'])
+            keyset = []
+            for i, (expression, direction) in enumerate(order):
+                value = after[i]
+                if value is None:
+                    if direction == 'desc':
+                        # nothing sorts after a null, descending
+                        continue
+                    past = f'{expression} IS NOT NULL'
+                elif direction == 'asc':
+                    past = f'{expression} > ?'
+                else:
+                    past = f'({expression} < ? OR {expression} IS NULL)'
+                equal = [f'{e} IS ?' for e, _ in order[:i]]
+                keyset.append('(' + ' AND '.join(equal + [past]) + ')')
+                args = args + after[:i] + ([] if value is None else [value])
+            conditions = conditions + ['(' + ' OR '.join(keyset or ['0']) + ')']
+        order_by = ', '.join(f'{e} {d.upper()}' for e, d in order)
+        if paging.KEY_FIELD not in [s[0] for s in sort]:
+            order_by = order_by + ', id' if order_by else 'id'
+
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+        limit = int(params.get('limit', 100))
+        # one more record than needed shows whether there are any after this page
+        rows = self.db.execute(f'SELECT data FROM records {where} ORDER BY {order_by} '
+                               f'LIMIT ? OFFSET ?',
+                               args + [limit + 1, int(params.get('offset', 0))]).fetchall()
+        after = ''
+        if sort and len(rows) > limit > 0:
+            last = json.loads(rows[limit - 1][0])
+            after = f', "after": {json.dumps([last.get(s[0]) for s in sort])}'
+        rows = rows[:limit]
+        fields = params.get('fields')
+        if fields:
+            records = [json.dumps({f: r[f] for f in fields if f in r})
+                       for r in (json.loads(row[0]) for row in rows)]
+        else:
+            # records are stored as JSON, so they don't need decoding to be sent back
+            records = [row[0] for row in rows]
+        body = f'{{"success": true, "result": {{"resource_id": {json.dumps(self.resource_id)}, ' \
+               f'"total": {total}, "records": [{", ".join(records)}]{after}}}}}'
+        return body.encode('utf-8')
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        '''
+        Answer a request as if it had been sent to the portal.
+        :param url: the URL the request would have been sent to
+        :param params: the request parameters
+        :param headers: ignored
+        :return: a response object
+        '''
+        with self._lock:
+            try:
+                return CachedResponse(url, 200, self.search(params or {}), 'OK')
+            except ValueError as e:
+                body = {'success': False, 'error': {'message': str(e)}}
+                return CachedResponse(url, 409, json.dumps(body).encode('utf-8'), str(e))
+
+    def close(self):
+        self.db.close()
+
+
+class LocalAPI(BaseAPI):
+    def __init__(self, path):
+        '''
+        Searches a local mirror of a resource (see API.mirror()) instead of the portal.
+        records() and assets() take the same parameters and return the same iterators as
+        API's, except that the free text query is simpler: every word of it has to appear
+        somewhere in the record.
+        :param path: the path of the mirror's SQLite file
+        '''
+        super(LocalAPI, self).__init__()
+        self.session = LocalSession(path)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,217 @@
+import json
+import logging
+import sqlite3
+import time
+
+from . import pagination as paging
+from .errors import IncompleteResultsError
+
+log = logging.getLogger('pyportal')
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS records (id INTEGER PRIMARY KEY, data TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)'
+    ]
+
+
+def field_expression(field):
+    '''
+    Get the SQL expression for the value of a field in a mirrored record. Field names are
+    written into the SQL rather than passed as parameters, so that queries use the indexes
+    made on the same expressions.
+    :param field: the name of the field
+    :return: str
+    '''
+    if field == paging.KEY_FIELD:
+        return 'id'
+    if '"' in field:
+        raise ValueError(f'Field names containing " are not supported: {field}')
+    path = '$."' + field.replace("'", "''") + '"'
+    return f"json_extract(data, '{path}')"
+
+
+def connect(path):
+    '''
+    Open a mirror database, creating its tables if they don't exist yet.
+    :param path: the path of the SQLite file
+    :return: a sqlite3 connection
+    '''
+    db = sqlite3.connect(path, check_same_thread=False)
+    # let searches read the mirror while it's being synced
+    db.execute('PRAGMA journal_mode=WAL')
+    for statement in SCHEMA:
+        db.execute(statement)
+    db.commit()
+    return db
+
+
+def read_meta(db):
+    '''
+    Read everything recorded about a mirror.
+    :param db: a sqlite3 connection
+    :return: dict
+    '''
+    return {k: json.loads(v) for k, v in db.execute('SELECT key, value FROM meta')}
+
+
+class Mirror(object):
+    def __init__(self, api, resource_id, path, modified_field=None, index_fields=None,
+                 page_size=1000):
+        '''
+        A copy of a resource in a local SQLite file, which LocalAPI can search. Records are
+        stored as JSON, with indexes on the values of the fields in index_fields so searches
+        filtering or sorting on them are fast. Use sync() to fill it and keep it up to date.
+        :param api: the API to get records from
+        :param resource_id: the id of the resource to mirror
+        :param path: the path of the SQLite file
+        :param modified_field: a field holding when each record was last changed, as values
+                               that sort in time order (e.g. ISO dates); without it, sync()
+                               can only find new records, not changed ones (optional)
+        :param index_fields: fields to index, e.g. ones you often filter on (optional)
+        :param page_size: number of records to request per page (optional)
+        '''
+        self.api = api
+        self.resource_id = resource_id
+        self.path = path
+        self.page_size = page_size
+        self.db = connect(path)
+        meta = read_meta(self.db)
+        if meta.get('resource_id', resource_id) != resource_id:
+            raise ValueError(f'{path} is a mirror of {meta["resource_id"]}, not {resource_id}.')
+        self.modified_field = modified_field or meta.get('modified_field')
+        self.index_fields = list(meta.get('index_fields', []))
+        self.index_fields += [f for f in index_fields or [] if f not in self.index_fields]
+        if self.modified_field is not None and self.modified_field not in self.index_fields:
+            self.index_fields.append(self.modified_field)
+        for field in self.index_fields:
+            self.db.execute(f'CREATE INDEX IF NOT EXISTS "records_{field}" '
+                            f'ON records ({field_expression(field)})')
+        self._set_meta(resource_id=resource_id, modified_field=self.modified_field,
+                       index_fields=self.index_fields)
+        self.db.commit()
+
+    @property
+    def meta(self):
+        return read_meta(self.db)
+
+    def _set_meta(self, **values):
+        self.db.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                            [(k, json.dumps(v)) for k, v in values.items()])
+
+    def count(self):
+        '''
+        The number of records in the mirror.
+        :return: int
+        '''
+        return self.db.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+
+    def _store(self, records, **meta):
+        '''
+        Add or replace records, along with any changes to the metadata, in one transaction, so
+        the mirror is always consistent with how far a sync got.
+        '''
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO records (id, data) VALUES (?, ?)',
+                                [(r[paging.KEY_FIELD], json.dumps(r)) for r in records])
+            self._set_meta(**meta)
+
+    def _pages(self, search, after=None, limit=None):
+        '''
+        Get the pages of a search, starting with pages of the given size and doubling it for
+        each page up to the page size.
+        '''
+        search.raise_errors = True
+        search.use_cache = False
+        search.params['limit'] = limit or self.page_size
+        search.after = after
+        while True:
+            try:
+                yield search.next()
+            except StopIteration:
+                return
+            search.params['limit'] = min(search.params['limit'] * 2, self.page_size)
+
+    def _pull_new(self):
+        '''
+        Get every record with an _id after the largest one in the mirror. Progress is saved
+        after each page, so an interrupted load carries on from where it stopped.
+        :return: the number of records added
+        '''
+        last_id = self.db.execute('SELECT MAX(id) FROM records').fetchone()[0]
+        search = self.api.records(self.resource_id, sort=[f'{paging.KEY_FIELD} asc'],
+                                  pagination=paging.CURSOR)
+        added = 0
+        for page in self._pages(search, [last_id] if last_id is not None else None):
+            self._store(page)
+            added += len(page)
+        return added
+
+    def _pull_changed(self, watermark, last_id):
+        '''
+        Get the records that have changed since the last sync, by going through the resource
+        from the most recently modified record back to the watermark.
+        :param watermark: the latest modified value in the mirror at the last sync
+        :param last_id: records after this _id were added in this sync, so don't need updating
+        :return: the number of records updated
+        '''
+        search = self.api.records(self.resource_id, sort=[f'{self.modified_field} desc'],
+                                  pagination=paging.CURSOR)
+        updated = 0
+        # usually only a few records have changed, so start small
+        for page in self._pages(search, limit=min(100, self.page_size)):
+            # records modified at the watermark itself may not have been seen, so are included
+            changed = [r for r in page if r.get(self.modified_field) is not None and
+                       r[self.modified_field] >= watermark]
+            changed = [r for r in changed if last_id is None or r[paging.KEY_FIELD] <= last_id]
+            self._store(changed)
+            updated += len(changed)
+            if page[-1].get(self.modified_field) is None or \
+                    page[-1][self.modified_field] < watermark:
+                break
+        return updated
+
+    def sync(self, full=False):
+        '''
+        Bring the mirror up to date. The first sync loads the whole resource (and continues
+        where it left off if it was interrupted); after that, only records added since the
+        last sync are requested, plus (if there's a modified_field) those changed since then.
+        Records deleted from the resource can't be found this way; if the number of records
+        no longer matches, a warning is logged, and sync(full=True) will reload everything.
+        The API's cache, if it has one, isn't used, as it could hide changes.
+        :param full: delete everything in the mirror and load the resource again (optional)
+        :return: dict with the numbers of records added and updated, and the total
+        '''
+        if full:
+            with self.db:
+                self.db.execute('DELETE FROM records')
+                self._set_meta(complete=False, watermark=None)
+        meta = self.meta
+        complete = meta.get('complete', False)
+        last_id = self.db.execute('SELECT MAX(id) FROM records').fetchone()[0]
+        started = time.time()
+        added = self._pull_new()
+        updated = 0
+        watermark = meta.get('watermark')
+        if complete and self.modified_field is not None and watermark is not None:
+            updated = self._pull_changed(watermark, last_id)
+        if self.modified_field is not None:
+            expression = field_expression(self.modified_field)
+            watermark = self.db.execute(f'SELECT MAX({expression}) FROM records').fetchone()[0]
+
+        total = self.count()
+        search = self.api.records(self.resource_id)
+        search.use_cache = False
+        expected = search.count()
+        message = f'The mirror has {total} records but {self.resource_id} has {expected}.'
+        if total != expected and not complete:
+            raise IncompleteResultsError(message)
+        with self.db:
+            self._set_meta(complete=True, watermark=watermark, synced=started)
+        if total != expected:
+            log.warning(message + ' Records may have been deleted; use sync(full=True) to '
+                                  'reload it.')
+        log.info(f'Synced {self.path}: {added} added, {updated} updated, {total} in total.')
+        return {'added': added, 'updated': updated, 'total': total}
+
+    def close(self):
+        self.db.close()
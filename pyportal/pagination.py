@@ -0,0 +1,45 @@
+import logging
+
+log = logging.getLogger('pyportal')
+
+OFFSET = 'offset'
+CURSOR = 'cursor'
+strategies = [OFFSET, CURSOR]
+
+# every record has a unique _id, so it breaks ties between records with the same sort values
+KEY_FIELD = '_id'
+
+
+def sort_fields(sort):
+    '''
+    Get the field names from a list of sorts.
+    :param sort: list of fields and directions, e.g. ['genus desc', '_id asc']
+    :return: list of field names, e.g. ['genus', '_id']
+    '''
+    return [s.split()[0] for s in sort or []]
+
+
+def keyset_sort(sort):
+    '''
+    Make sure a sort ends on the unique key field, so that the sort values of a record identify
+    its position in the result set exactly.
+    :param sort: list of fields and directions (or None)
+    :return: list of fields and directions
+    '''
+    sort = list(sort or [])
+    if KEY_FIELD not in sort_fields(sort):
+        sort.append(f'{KEY_FIELD} asc')
+    return sort
+
+
+def keyset_fields(fields, sort):
+    '''
+    Make sure the fields returned for each record include the ones it's sorted by, so its
+    position in the sort can be checked.
+    :param fields: list of fields to return (empty or None means all)
+    :param sort: list of fields and directions
+    :return: list of fields to return
+    '''
+    if not fields:
+        return fields
+    return list(fields) + [f for f in sort_fields(sort) if f not in fields]
@@ -0,0 +1,168 @@
+from collections.abc import Mapping
+
+from .decoding import loads
+
+# fields that hold JSON strings, which compact rows only decode when they're used
+LAZY_FIELDS = ['associatedMedia']
+
+# strings up to this length are shared between rows, as short values (countries, collection
+# codes, families etc) are repeated a lot
+MAX_SHARED_LENGTH = 32
+# the most strings to keep for sharing before starting again
+MAX_SHARED = 100000
+
+
+class LazyJSON(object):
+    '''
+    A JSON string that's decoded the first time its value is used. It can be iterated over,
+    indexed and compared like the value itself.
+    '''
+    __slots__ = ['raw', '_value', '_decoded']
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._value = None
+        self._decoded = False
+
+    @property
+    def value(self):
+        if not self._decoded:
+            self._value = loads(self.raw)
+            self._decoded = True
+        return self._value
+
+    def __getitem__(self, item):
+        return self.value[item]
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __eq__(self, other):
+        return self.value == (other.value if isinstance(other, LazyJSON) else other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+class FieldTable(object):
+    '''
+    The field names of a set of rows, and the position of each field's value in them.
+    '''
+    __slots__ = ['names', 'positions']
+
+    def __init__(self, names):
+        self.names = names
+        self.positions = {name: i for i, name in enumerate(names)}
+
+
+class Row(Mapping):
+    '''
+    A compact, read-only record: a tuple of values plus a field table shared with every other
+    row that has the same fields. It behaves like a dict (row['genus'], row.get('genus'),
+    row.items() etc), except that JSON fields like associatedMedia are decoded when they're
+    used. Use to_dict() to get an ordinary dict.
+    '''
+    __slots__ = ['_fields', '_values']
+
+    def __init__(self, fields, values):
+        '''
+        :param fields: a FieldTable
+        :param values: a tuple of values, in the order of the field table
+        '''
+        self._fields = fields
+        self._values = values
+
+    def __getitem__(self, field):
+        value = self._values[self._fields.positions[field]]
+        return value.value if isinstance(value, LazyJSON) else value
+
+    def __contains__(self, field):
+        return field in self._fields.positions
+
+    def __iter__(self):
+        return iter(self._fields.names)
+
+    def __len__(self):
+        return len(self._values)
+
+    def to_dict(self, raw=False):
+        '''
+        Convert the row into a dict.
+        :param raw: if True, leave JSON fields as the strings they were received as, so the
+                    dict is the same as the record would have been without compact mode
+                    (optional)
+        :return: dict
+        '''
+        if raw:
+            values = (v.raw if isinstance(v, LazyJSON) else v for v in self._values)
+        else:
+            values = (v.value if isinstance(v, LazyJSON) else v for v in self._values)
+        return dict(zip(self._fields.names, values))
+
+    def __eq__(self, other):
+        if isinstance(other, Row):
+            other = other.to_dict(raw=True)
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return self.to_dict(raw=True) == other or self.to_dict() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'Row({self.to_dict(raw=True)!r})'
+
+    def __reduce__(self):
+        return Row, (self._fields, self._values)
+
+
+class RowFactory(object):
+    def __init__(self, lazy_fields=None):
+        '''
+        Turns records into Rows, sharing field tables and short string values between them.
+        :param lazy_fields: fields holding JSON strings to decode only when they're used
+                            (optional; defaults to LAZY_FIELDS)
+        '''
+        self.lazy_fields = set(lazy_fields if lazy_fields is not None else LAZY_FIELDS)
+        self._tables = {}
+        self._shared = {}
+
+    def row(self, record):
+        '''
+        Make a Row from a record.
+        :param record: a record dict
+        :return: a Row
+        '''
+        names = tuple(record)
+        fields = self._tables.get(names)
+        if fields is None:
+            fields = self._tables[names] = FieldTable(names)
+        if len(self._shared) > MAX_SHARED:
+            self._shared = {}
+        shared = self._shared
+        values = []
+        for name, value in record.items():
+            if type(value) is str:
+                if name in self.lazy_fields:
+                    value = LazyJSON(value)
+                elif len(value) <= MAX_SHARED_LENGTH:
+                    value = shared.setdefault(value, value)
+            values.append(value)
+        return Row(fields, tuple(values))
+
+
+def to_asset(record, lazy=False):
+    '''
+    Convert a record into an asset tuple.
+    :param record: a record dict
+    :param lazy: if True, don't decode the media until it's used (optional)
+    :return: tuple in the form (record_id, list of asset dicts)
+    '''
+    media = record.get('associatedMedia')
+    if isinstance(media, str):
+        media = LazyJSON(media) if lazy else loads(media)
+    return record.get('_id'), media
@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .hooks import Hooks
+
+log = logging.getLogger('pyportal')
+
+
+def response_size(response, stream=False):
+    '''
+    Get the number of bytes transferred for a response body: the Content-Length if the server
+    sent one (which is the compressed size, for compressed responses), or otherwise the size of
+    the body, if it's already been downloaded.
+    :param response: a response object
+    :param stream: whether the body is still to be streamed
+    :return: int, or None if it's not known yet
+    '''
+    length = response.headers.get('Content-Length')
+    if length is not None:
+        return int(length)
+    return None if stream else len(response.content)
+
+
+class Session(object):
+    def __init__(self, pool_size=10, keep_alive=True, gzip=True, timeout=30, cache=None,
+                 controller=None, hooks=None):
+        '''
+        A pooled HTTP session shared by an API instance and all the iterators it creates.
+        :param pool_size: maximum number of connections kept open per host
+        :param keep_alive: whether to reuse connections between requests
+        :param gzip: whether to ask the server for gzip-compressed responses
+        :param timeout: default timeout (in seconds) for each request; None waits forever
+        :param cache: a pyportal.cache.Cache to serve repeated requests from (optional)
+        :param controller: a pyportal.control.RequestController to rate limit and retry
+                           requests (optional)
+        :param hooks: a pyportal.hooks.Hooks to notify about requests (optional)
+        '''
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.gzip = gzip
+        self.timeout = timeout
+        self.cache = cache
+        self.controller = controller
+        self.hooks = hooks if hooks is not None else Hooks()
+        self._session = None
+        # threads can make their first requests at the same time, and must share one pool
+        self._lock = threading.Lock()
+
+    @property
+    def page_sizer(self):
+        '''
+        The shared PageSizer that adjusts how many records are requested per page, if adaptive
+        page sizes are enabled.
+        :return: a pyportal.control.PageSizer, or None
+        '''
+        return self.controller.page_sizer if self.controller is not None else None
+
+    @property
+    def session(self):
+        '''
+        The underlying requests session, created on first use (and again after close()).
+        :return: a requests.Session instance
+        '''
+        with self._lock:
+            if self._session is None:
+                self._session = self._build()
+            return self._session
+
+    def _build(self):
+        '''
+        Create a requests session with a connection pool sized for this instance.
+        :return: a requests.Session instance
+        '''
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers['Accept-Encoding'] = 'gzip, deflate' if self.gzip else 'identity'
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def get(self, url, params=None, headers=None, cache=True, **kwargs):
+        '''
+        Make a GET request through the connection pool, or serve it from the cache if there is
+        one (streamed requests are never cached).
+        :param url: the URL to request
+        :param params: query parameters
+        :param headers: any extra headers for this request
+        :param cache: if False, don't use the cache for this request, e.g. because an up to
+                      date response is needed (optional)
+        :param kwargs: other arguments passed to requests, e.g. stream=True
+        :return: the response object
+        '''
+        kwargs.setdefault('timeout', self.timeout)
+        stream = kwargs.get('stream', False)
+        self.hooks.fire('on_request_start', url=url, params=params)
+        started = time.perf_counter()
+        key = None
+        response = None
+        if self.cache is not None and cache and not stream:
+            key = self.cache.key(url, params, (headers or {}).get('Authorization'))
+            response = self.cache.get(key)
+        cached = response is not None
+        if not cached:
+            response = self._send(
+                lambda: self.session.get(url, params=params, headers=headers, **kwargs), url)
+        if key is not None and not cached:
+            self.cache.set(key, response)
+        self.hooks.fire('on_request_end', url=url, params=params, status=response.status_code,
+                        elapsed=time.perf_counter() - started,
+                        bytes=response_size(response, stream), cached=cached)
+        return response
+
+    def head(self, url, headers=None, **kwargs):
+        '''
+        Make a HEAD request through the connection pool.
+        :param url: the URL to request
+        :param headers: any extra headers for this request
+        :param kwargs: other arguments passed to requests
+        :return: the response object
+        '''
+        kwargs.setdefault('timeout', self.timeout)
+        return self._send(lambda: self.session.head(url, headers=headers, **kwargs), url)
+
+    def _send(self, request, url):
+        '''
+        Make a request through the controller, if there is one.
+        :param request: a function with no arguments that makes the request
+        :param url: the URL being requested
+        :return: the response object
+        '''
+        if self.controller is None:
+            return request()
+
+        def on_retry(attempt, wait, reason):
+            self.hooks.fire('on_retry', url=url, attempt=attempt, wait=wait, reason=reason)
+
+        return self.controller.send(request, on_retry=on_retry)
+
+    def close(self):
+        '''
+        Close all pooled connections. The session can still be used afterwards; a new pool will
+        be opened on the next request.
+        '''
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
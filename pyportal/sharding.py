@@ -0,0 +1,119 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from . import pagination as paging
+from .errors import IncompleteResultsError
+
+log = logging.getLogger('pyportal')
+
+
+class Shard(object):
+    def __init__(self, filters=None, lower=None, upper=None, size=None):
+        '''
+        One part of a search that's been split up so the parts can be fetched in parallel. A
+        shard either adds filters to the search, or covers a range of _ids: the portal can only
+        filter on exact values, so a range starts from a continuation token (the _id before it)
+        and ends when a record past its last _id is reached.
+        :param filters: filters to add to the search's own (optional)
+        :param lower: the _id just before the range, or None to start from the beginning
+        :param upper: the last _id in the range, or None to go to the end
+        :param size: the number of records expected in the shard (optional)
+        '''
+        self.filters = filters or {}
+        self.lower = lower
+        self.upper = upper
+        self.size = size
+
+    def __repr__(self):
+        return f'Shard(filters={self.filters}, lower={self.lower}, upper={self.upper}, ' \
+               f'size={self.size})'
+
+
+def balance(counts, n):
+    '''
+    Divide values into at most n groups with totals as even as possible, by putting each value
+    (largest first) into the group with the smallest total so far.
+    :param counts: dict of value to the number of records with that value
+    :param n: the maximum number of groups
+    :return: list of (list of values, total) tuples, largest first
+    '''
+    groups = [([], 0) for _ in range(min(n, len(counts)))]
+    for value, count in sorted(counts.items(), key=lambda c: c[1], reverse=True):
+        values, total = min(groups, key=lambda g: g[1])
+        groups.remove((values, total))
+        groups.append((values + [value], total + count))
+    return sorted(groups, key=lambda g: g[1], reverse=True)
+
+
+def search_filters(search):
+    '''
+    Get the filters of a search.
+    :param search: a ResultsIterator
+    :return: dict of field to value
+    '''
+    filters = search.params.get('filters') or {}
+    return json.loads(filters) if isinstance(filters, str) else dict(filters)
+
+
+def plan_id_shards(search, n, total, workers):
+    '''
+    Split a search into ranges of _ids holding (almost exactly) the same number of records,
+    by looking up the _id at each boundary.
+    :param search: a ResultsIterator
+    :param n: the number of shards
+    :param total: the number of records in the search
+    :param workers: number of threads to make the requests on
+    :return: list of Shards
+    '''
+    n = max(min(n, total), 1)
+    offsets = [total * k // n for k in range(1, n)]
+    sort = [f'{paging.KEY_FIELD} asc']
+
+    def boundary(offset):
+        records = search._probe(limit=1, offset=offset - 1, sort=sort,
+                                fields=[paging.KEY_FIELD]).get('records') or []
+        if len(records) == 0:
+            raise IncompleteResultsError(f'No record at offset {offset - 1}; the resource may '
+                                         f'have changed.')
+        return records[0][paging.KEY_FIELD]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        boundaries = list(executor.map(boundary, offsets))
+    starts = [0] + offsets
+    ends = offsets + [total]
+    lowers = [None] + boundaries
+    uppers = boundaries + [None]
+    return [Shard(lower=lower, upper=upper, size=end - start)
+            for lower, upper, start, end in zip(lowers, uppers, starts, ends)]
+
+
+def plan_value_shards(search, n, field, values, total, workers):
+    '''
+    Split a search by the values of a field, counting the records for each value and grouping
+    the values so each shard has about the same number of records.
+    :param search: a ResultsIterator
+    :param n: the maximum number of shards
+    :param field: the name of the field
+    :param values: every value the field has in the search
+    :param total: the number of records in the search
+    :param workers: number of threads to make the requests on
+    :return: list of Shards
+    '''
+    filters = search_filters(search)
+    if field in filters:
+        raise ValueError(f'The search is already filtered on "{field}".')
+
+    def count(value):
+        value_filters = json.dumps(dict(filters, **{field: value}))
+        return search._probe(filters=value_filters).get('total', 0)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        counts = dict(zip(values, executor.map(count, values)))
+    if sum(counts.values()) != total:
+        raise IncompleteResultsError(f'The values of "{field}" given cover '
+                                     f'{sum(counts.values())} records, but the search has '
+                                     f'{total}.')
+    counts = {value: c for value, c in counts.items() if c > 0}
+    return [Shard(filters={field: group[0] if len(group) == 1 else group}, size=size)
+            for group, size in balance(counts, n)]
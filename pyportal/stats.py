@@ -0,0 +1,240 @@
+import threading
+import time
+
+
+def percentile(values, p):
+    '''
+    Get a percentile of a list of values, interpolating between the nearest two.
+    :param values: list of numbers
+    :param p: the percentile, from 0 to 100
+    :return: float, or None if there are no values
+    '''
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * p / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+class SearchStats(object):
+    def __init__(self):
+        '''
+        Performance statistics for a single search: how many requests it made, how much data
+        it transferred, and where the time went. Times are in seconds. When pages are
+        prefetched, network time is summed across threads, so it can be more than the elapsed
+        time.
+        '''
+        self.requests = 0
+        self.cached = 0
+        self.bytes = 0
+        self.records = 0
+        self.network_time = 0.0
+        self.decode_time = 0.0
+        self.consumer_time = 0.0
+        self.latencies = []
+        self.started = None
+        self.updated = None
+        self._lock = threading.Lock()
+
+    def _touch(self):
+        now = time.perf_counter()
+        if self.started is None:
+            self.started = now
+        self.updated = now
+
+    def request(self, elapsed, nbytes=0, cached=False):
+        '''
+        Record a finished request.
+        :param elapsed: how long the request took
+        :param nbytes: the size of the response body (as transferred, if it was compressed)
+        :param cached: whether the response came from the cache
+        '''
+        with self._lock:
+            if self.started is None:
+                self.started = time.perf_counter() - elapsed
+            self._touch()
+            self.requests += 1
+            self.cached += 1 if cached else 0
+            self.bytes += nbytes or 0
+            self.network_time += elapsed
+            self.latencies.append(elapsed)
+
+    def page(self, records, elapsed):
+        '''
+        Record a decoded page.
+        :param records: the number of records in the page
+        :param elapsed: how long decoding took
+        '''
+        with self._lock:
+            self._touch()
+            self.records += records
+            self.decode_time += elapsed
+
+    def consumed(self, elapsed):
+        '''
+        Record time spent outside the search, by the code consuming its records.
+        :param elapsed: the time spent
+        '''
+        with self._lock:
+            self.consumer_time += elapsed
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return self.updated - self.started
+
+    @property
+    def records_per_second(self):
+        return self.records / self.elapsed if self.elapsed > 0 else 0.0
+
+    def latency_percentiles(self, percentiles=(50, 90, 99)):
+        '''
+        Get percentiles of the request latencies.
+        :param percentiles: the percentiles to calculate (optional)
+        :return: dict of percentile to latency in seconds
+        '''
+        with self._lock:
+            latencies = list(self.latencies)
+        return {p: percentile(latencies, p) for p in percentiles}
+
+    def as_dict(self):
+        '''
+        All the statistics, e.g. for logging or serialising.
+        :return: dict
+        '''
+        return {
+            'requests': self.requests,
+            'cached': self.cached,
+            'bytes': self.bytes,
+            'records': self.records,
+            'elapsed': self.elapsed,
+            'network_time': self.network_time,
+            'decode_time': self.decode_time,
+            'consumer_time': self.consumer_time,
+            'records_per_second': self.records_per_second,
+            'latency': self.latency_percentiles()
+            }
+
+    def __str__(self):
+        p = self.latency_percentiles()
+        latency = ', '.join(f'p{k} {v:.3f}s' for k, v in p.items() if v is not None)
+        return f'{self.records} records from {self.requests} requests ({self.bytes} bytes) in ' \
+               f'{self.elapsed:.2f}s [{self.records_per_second:.0f} records/s; network ' \
+               f'{self.network_time:.2f}s, decoding {self.decode_time:.2f}s, consumer ' \
+               f'{self.consumer_time:.2f}s; latency {latency or "n/a"}]'
+
+
+class Metrics(object):
+    '''
+    Base class for exporting request metrics to a monitoring system through an API's hooks.
+    '''
+
+    def on_request_end(self, status, elapsed, bytes, cached, **info):
+        pass
+
+    def on_page_decoded(self, records, elapsed, **info):
+        pass
+
+    def on_retry(self, **info):
+        pass
+
+    def attach(self, api):
+        '''
+        Start recording metrics for an API's requests.
+        :param api: an API instance
+        :return: this instance
+        '''
+        for event in ['on_request_end', 'on_page_decoded', 'on_retry']:
+            api.hooks.add(event, getattr(self, event))
+        return self
+
+
+class PrometheusMetrics(Metrics):
+    def __init__(self, registry=None, prefix='pyportal'):
+        '''
+        Exports request metrics to Prometheus; attach it to an API with attach(). Needs
+        prometheus_client.
+        :param registry: the prometheus_client registry to use (optional; defaults to the
+                         global one)
+        :param prefix: prefix for the metric names (optional)
+        '''
+        try:
+            import prometheus_client
+        except ImportError:
+            raise ImportError('prometheus_client is required for Prometheus metrics: '
+                              'pip install prometheus_client')
+        kwargs = {'registry': registry} if registry is not None else {}
+        self.requests = prometheus_client.Counter(f'{prefix}_requests_total',
+                                                  'Requests made to the portal', ['status'],
+                                                  **kwargs)
+        self.latency = prometheus_client.Histogram(f'{prefix}_request_seconds',
+                                                   'Time taken by requests to the portal',
+                                                   **kwargs)
+        self.bytes = prometheus_client.Counter(f'{prefix}_response_bytes_total',
+                                               'Bytes received from the portal', **kwargs)
+        self.records = prometheus_client.Counter(f'{prefix}_records_total',
+                                                 'Records decoded from responses', **kwargs)
+        self.decode = prometheus_client.Histogram(f'{prefix}_decode_seconds',
+                                                  'Time taken to decode pages', **kwargs)
+        self.retries = prometheus_client.Counter(f'{prefix}_retries_total',
+                                                 'Requests that were retried', **kwargs)
+
+    def on_request_end(self, status, elapsed, bytes, cached, **info):
+        self.requests.labels(status=str(status)).inc()
+        if not cached:
+            self.latency.observe(elapsed)
+        self.bytes.inc(bytes or 0)
+
+    def on_page_decoded(self, records, elapsed, **info):
+        self.records.inc(records)
+        self.decode.observe(elapsed)
+
+    def on_retry(self, **info):
+        self.retries.inc()
+
+
+class OpenTelemetryMetrics(Metrics):
+    def __init__(self, meter=None, prefix='pyportal'):
+        '''
+        Exports request metrics through OpenTelemetry; attach it to an API with attach(). Needs
+        opentelemetry-api.
+        :param meter: the OpenTelemetry meter to use (optional; defaults to one from the global
+                      meter provider)
+        :param prefix: prefix for the metric names (optional)
+        '''
+        if meter is None:
+            try:
+                from opentelemetry import metrics
+            except ImportError:
+                raise ImportError('opentelemetry-api is required for OpenTelemetry metrics: '
+                                  'pip install opentelemetry-api')
+            meter = metrics.get_meter('pyportal')
+        self.requests = meter.create_counter(f'{prefix}.requests',
+                                              description='Requests made to the portal')
+        self.latency = meter.create_histogram(f'{prefix}.request.duration', unit='s',
+                                               description='Time taken by requests to the '
+                                                           'portal')
+        self.bytes = meter.create_counter(f'{prefix}.response.bytes', unit='By',
+                                           description='Bytes received from the portal')
+        self.records = meter.create_counter(f'{prefix}.records',
+                                             description='Records decoded from responses')
+        self.decode = meter.create_histogram(f'{prefix}.decode.duration', unit='s',
+                                              description='Time taken to decode pages')
+        self.retries = meter.create_counter(f'{prefix}.retries',
+                                             description='Requests that were retried')
+
+    def on_request_end(self, status, elapsed, bytes, cached, **info):
+        self.requests.add(1, {'status': str(status)})
+        if not cached:
+            self.latency.record(elapsed)
+        self.bytes.add(bytes or 0)
+
+    def on_page_decoded(self, records, elapsed, **info):
+        self.records.add(records)
+        self.decode.record(elapsed)
+
+    def on_retry(self, **info):
+        self.retries.add(1)
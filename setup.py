@@ -13,6 +13,11 @@ AUTHOR = 'Natural History Museum'
 VERSION = '0.1'
 
 REQUIRED = ['requests']
+EXTRAS = {
+    'async': ['aiohttp'],
+    'fast': ['ijson', 'orjson'],
+    'columnar': ['numpy', 'pyarrow'],
+    }
 
 readme = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'README.md')
 try:
@@ -31,8 +36,9 @@ setup(
     author=AUTHOR,
     author_email=EMAIL,
     url=URL,
-    packages=find_packages(exclude=('tests',)),
+    packages=find_packages(exclude=('tests', 'benchmarks')),
     install_requires=REQUIRED,
+    extras_require=EXTRAS,
     package_data={},
     include_package_data=True,
     entry_points='''
@@ -0,0 +1,103 @@
+import json
+
+import pyportal
+import pytest
+
+
+class FakeResponse(object):
+    def __init__(self, body=None, status_code=200, headers=None, content=None,
+                 url='https://data.nhm.ac.uk/api/3/action/datastore_search'):
+        if content is None:
+            content = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.url = url
+        self.content = content
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.reason = 'OK' if self.ok else 'Error'
+        self.headers = dict(headers or {})
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeSession(object):
+    '''
+    Serves datastore_search-like responses from a list of records, and asset files (the asset
+    ID repeated 100 times) with support for ranges.
+    '''
+
+    def __init__(self, records=None):
+        self.records = records or []
+        self.pool_size = 10
+        self.requests = []
+        # the URL and headers of each request for an asset file
+        self.downloads = []
+        # responses to send instead of a page, by request number (counting from 0)
+        self.errors = {}
+        # whether to return continuation tokens for sorted searches
+        self.tokens = True
+
+    @staticmethod
+    def asset_content(url):
+        return url.split('/asset/')[1].split('/')[0].encode('utf-8') * 100
+
+    def head(self, url, **kwargs):
+        content = self.asset_content(url)
+        return FakeResponse(headers={'Content-Length': str(len(content))}, url=url)
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        if '/asset/' in url:
+            self.downloads.append((url, headers))
+            content = self.asset_content(url)
+            status_code = 200
+            if headers and 'Range' in headers:
+                content = content[int(headers['Range'].split('=')[1].rstrip('-')):]
+                status_code = 206
+            return FakeResponse(content=content, status_code=status_code, url=url,
+                                headers={'Content-Length': str(len(content))})
+        self.requests.append(dict(params))
+        status_code = self.errors.get(len(self.requests) - 1)
+        if status_code is not None:
+            return FakeResponse({'success': False}, status_code=status_code)
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 100))
+        records = self.records
+        for field, value in json.loads(params.get('filters') or '{}').items():
+            if field == '_has_image':
+                records = [r for r in records if bool(r.get('associatedMedia')) == value]
+                continue
+            values = value if isinstance(value, list) else [value]
+            records = [r for r in records if r.get(field) in values]
+        total = len(records)
+        if 'after' in params:
+            last_id = json.loads(params['after'])[-1]
+            records = [r for r in records if r['_id'] > last_id]
+        page = records[offset:offset + limit]
+        result = {
+            'total': total,
+            'records': page
+            }
+        # records aren't sorted, but cursor searches are always sorted by _id last
+        sort = [s.split()[0] for s in params.get('sort') or []]
+        if self.tokens and sort and len(page) > 0 and offset + len(page) < len(records):
+            result['after'] = [page[-1].get(f) for f in sort]
+        if params.get('fields'):
+            result['records'] = [{f: r[f] for f in params['fields'] if f in r} for r in page]
+        return FakeResponse({'success': True, 'result': result})
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def api():
+    api = pyportal.API()
+    api.session = FakeSession([{'_id': i} for i in range(1, 2501)])
+    return api
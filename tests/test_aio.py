@@ -0,0 +1,79 @@
+import asyncio
+
+import pyportal
+import pytest
+from benchmarks.server import FakePortal
+
+aiohttp = pytest.importorskip('aiohttp')
+
+RESOURCE_ID = 'test-resource'
+
+
+@pytest.fixture(scope='module')
+def portal():
+    with FakePortal(records=2500, seed=3) as portal:
+        yield portal
+
+
+def run(portal, test, **kwargs):
+    async def main():
+        async with pyportal.AsyncAPI(base_url=portal.base_url, **kwargs) as api:
+            return await test(api)
+
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize('pagination', ['offset', 'cursor'])
+def test_async_for(portal, pagination):
+    async def test(api):
+        return [r async for r in api.records(RESOURCE_ID, pagination=pagination)]
+
+    records = run(portal, test)
+    assert [r['_id'] for r in records] == list(range(1, 2501))
+    with pyportal.API(base_url=portal.base_url) as api:
+        assert records == list(api.records(RESOURCE_ID).all())
+
+
+def test_first_and_count(portal):
+    async def test(api):
+        search = api.records(RESOURCE_ID, offset=10, collectionCode='BOT')
+        return await search.first(), await search.count()
+
+    first, count = run(portal, test)
+    with pyportal.API(base_url=portal.base_url) as api:
+        search = api.records(RESOURCE_ID, offset=10, collectionCode='BOT')
+        assert first == search.first()
+        assert count == search.count()
+
+
+def test_assets(portal):
+    async def test(api):
+        return [a async for a in api.assets(RESOURCE_ID, pagination='cursor')]
+
+    assets = run(portal, test)
+    with pyportal.API(base_url=portal.base_url) as api:
+        assert assets == list(api.assets(RESOURCE_ID).all())
+    assert all(isinstance(media, list) and len(media) > 0 for _, media in assets)
+
+
+def test_failed_request_ends_iteration():
+    async def test(api):
+        return [r async for r in api.records(RESOURCE_ID)]
+
+    with FakePortal(records=10, error_rate=1.0) as portal:
+        assert run(portal, test) == []
+
+
+def test_concurrency_limit():
+    searches = [{'resource_id': RESOURCE_ID, 'collectionCode': code}
+                for code in ['BOT', 'ENT', 'MIN', 'PAL', 'ZOO', 'NONE']]
+
+    async def test(api):
+        return await api.count_many(searches)
+
+    # the latency keeps each request in flight long enough for the others to be made
+    with FakePortal(records=100, latency=0.05) as portal:
+        counts = run(portal, test, concurrency=2)
+        assert portal.stats['requests'] == 6
+        assert portal.stats['max_in_flight'] <= 2
+    assert sum(counts.values()) == 100
@@ -1,5 +1,9 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pyportal
 import pyportal.errors
+import pyportal.session
 import pytest
 
 
@@ -35,3 +39,65 @@ def test_rejects_incorrect_url():
     no_resource = 'https://data.nhm.ac.uk'
     with pytest.raises(pyportal.errors.IncorrectURLError):
         pyportal.API.from_url(no_resource)
+
+
+def test_api_shares_session():
+    with pyportal.API(pool_size=4, timeout=5) as api:
+        search = api.records('resource-id')
+        assets = api.assets('resource-id')
+        assert search.session is api.session
+        assert assets.session is api.session
+        assert api.session.timeout == 5
+        pooled = api.session.session
+        assert api.session.session is pooled
+    assert api.session._session is None
+
+
+def test_async_api_builds_same_params():
+    pytest.importorskip('aiohttp')
+    sync_search = pyportal.API().records('resource-id', query='bugs', country='australia')
+    async_search = pyportal.AsyncAPI().records('resource-id', query='bugs', country='australia')
+    assert async_search.params == sync_search.params
+    assert async_search.session is not None
+
+
+def test_count_many(api):
+    api.session.records = [{'_id': i, 'code': 'abc'[i % 3]} for i in range(1, 301)]
+    searches = {
+        'all': {'resource_id': 'resource-id'},
+        'a': {'resource_id': 'resource-id', 'code': 'a'},
+        'a again': {'resource_id': 'resource-id', 'code': 'a', 'limit': 10},
+        'a or b': {'resource_id': 'resource-id', 'code': ['a', 'b']}
+        }
+    assert api.count_many(searches) == {'all': 300, 'a': 100, 'a again': 100, 'a or b': 200}
+    # identical searches are only counted once, and no records are requested
+    assert len(api.session.requests) == 3
+    assert all(p['limit'] == 0 for p in api.session.requests)
+    assert api.count_many([{'resource_id': 'resource-id', 'code': 'b'}]) == {0: 100}
+
+
+def test_search_many(api):
+    searches = [{'resource_id': 'resource-id', 'limit': 5},
+                {'resource_id': 'resource-id', 'limit': 5, 'offset': 2495},
+                {'resource_id': 'resource-id', 'offset': 2500}]
+    results = api.search_many(searches)
+    assert [[r['_id'] for r in results[i]] for i in range(3)] == \
+           [[1, 2, 3, 4, 5], [2496, 2497, 2498, 2499, 2500], []]
+    assert len(api.search_many([{'resource_id': 'resource-id'}], fetch_all=True)[0]) == 2500
+
+
+def test_session_is_built_once_across_threads(monkeypatch):
+    built = []
+    build = pyportal.session.Session._build
+
+    def slow_build(self):
+        time.sleep(0.01)
+        built.append(build(self))
+        return built[-1]
+
+    monkeypatch.setattr(pyportal.session.Session, '_build', slow_build)
+    with pyportal.API() as api:
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            sessions = list(executor.map(lambda _: api.session.session, range(5)))
+    assert len(built) == 1
+    assert all(s is built[0] for s in sessions)
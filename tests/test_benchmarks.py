@@ -0,0 +1,46 @@
+import pyportal
+import pytest
+from benchmarks import run
+from benchmarks.server import FakePortal
+
+RESOURCE_ID = 'test-resource'
+
+
+@pytest.fixture(scope='module')
+def portal():
+    with FakePortal(records=1200, media_rate=0.25, seed=1) as portal:
+        yield portal
+
+
+def test_fake_portal_searches(portal):
+    with pyportal.API(base_url=portal.base_url) as api:
+        assert len(list(api.records(RESOURCE_ID).all())) == 1200
+        bot = [r for r in portal.records if r['collectionCode'] == 'BOT']
+        search = api.records(RESOURCE_ID, fields=['_id', 'collectionCode'], collectionCode='BOT')
+        assert search.count() == len(bot)
+        assert list(search.all()) == [{'_id': r['_id'], 'collectionCode': 'BOT'} for r in bot]
+        cursor = api.records(RESOURCE_ID, sort=['genus desc'], pagination='cursor')
+        expected = sorted(portal.records, key=lambda r: (r['genus'], -r['_id']), reverse=True)
+        assert [r['_id'] for r in cursor.all()] == [r['_id'] for r in expected]
+        with_images = [r for r in portal.records if r['associatedMedia']]
+        assert len({i for i, _ in api.assets(RESOURCE_ID).all()}) == len(with_images)
+
+
+def test_fake_portal_errors_are_retried():
+    with FakePortal(records=500, error_rate=0.3, seed=2) as portal:
+        with pyportal.API(base_url=portal.base_url, retries=10) as api:
+            assert len(list(api.records(RESOURCE_ID).all())) == 500
+        assert portal.stats['errors'] > 0
+        assert portal.stats['requests'] == portal.stats['errors'] + 2
+
+
+def test_compare_finds_regressions():
+    def report(items_per_second, peak_memory_bytes, requests):
+        return {'results': {'all': {'items_per_second': items_per_second,
+                                    'peak_memory_bytes': peak_memory_bytes,
+                                    'requests': requests}}}
+
+    baseline = report(1000, 100, 5)
+    assert run.compare(report(900, 110, 5), baseline) == []
+    assert len(run.compare(report(700, 100, 5), baseline)) == 1
+    assert len(run.compare(report(1000, 200, 6), baseline)) == 2
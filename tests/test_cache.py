@@ -0,0 +1,80 @@
+import pyportal
+import pytest
+from benchmarks.server import FakePortal
+from conftest import FakeResponse
+from pyportal.cache import Cache
+
+
+@pytest.fixture
+def url():
+    return 'https://data.nhm.ac.uk/api/3/action/datastore_search'
+
+
+def test_key_normalises_params(url):
+    a = Cache.key(url, {'filters': '{"a": 1, "b": 2}', 'offset': 0, 'q': None})
+    b = Cache.key(url, {'offset': '0', 'filters': '{"b": 2, "a": 1}'})
+    assert a == b
+    assert Cache.key(url, {'offset': 0}) != Cache.key(url, {'offset': 100})
+    assert Cache.key(url, {'offset': 0}) != Cache.key(url, {'offset': 0}, auth='key')
+
+
+def test_hits_and_misses(url):
+    cache = Cache()
+    key = Cache.key(url, {'offset': 0})
+    assert cache.get(key) is None
+    cache.set(key, FakeResponse({'result': {'total': 5}}))
+    assert cache.get(key).json() == {'result': {'total': 5}}
+    cache.set(Cache.key(url, {'offset': 1}), FakeResponse({}, status_code=500))
+    assert cache.get(Cache.key(url, {'offset': 1})) is None
+    assert cache.stats['hits'] == 1
+    assert cache.stats['misses'] == 2
+
+
+def test_expired_entries_are_missed(url):
+    cache = Cache(ttl=-1)
+    key = Cache.key(url)
+    cache.set(key, FakeResponse({}))
+    assert cache.get(key) is None
+
+
+def test_disk_tier_is_bounded(url, tmp_path):
+    body = {'records': ['x' * 100]}
+    size = len(FakeResponse(body).content)
+    cache = Cache(str(tmp_path / 'cache.db'), max_bytes=size * 2, memory_bytes=0)
+    for offset in range(3):
+        cache.set(Cache.key(url, {'offset': offset}), FakeResponse(body))
+    assert cache.get(Cache.key(url, {'offset': 0})) is None
+    assert cache.get(Cache.key(url, {'offset': 2})) is not None
+    cache.close()
+
+    reopened = Cache(str(tmp_path / 'cache.db'))
+    assert reopened.get(Cache.key(url, {'offset': 1})).json() == body
+
+
+def test_api_serves_repeated_requests_from_cache():
+    with FakePortal(records=2500, seed=1) as portal:
+        with pyportal.API(base_url=portal.base_url, cache=Cache()) as api:
+            search = api.records('resource-id')
+            records = list(search.all())
+            first = search.first()
+            count = search.count()
+            requests = portal.stats['requests']
+
+            assert list(api.records('resource-id').all()) == records
+            assert api.records('resource-id').first() == first
+            assert api.records('resource-id').count() == count == 2500
+            assert portal.stats['requests'] == requests
+            assert api.cache.stats['hits'] == requests
+
+            # streamed pages aren't cached
+            assert list(api.records('resource-id').all(stream=True)) == records
+            assert portal.stats['requests'] > requests
+
+
+def test_api_does_not_cache_server_errors():
+    with FakePortal(records=10, error_rate=1.0, error_status=500) as portal:
+        with pyportal.API(base_url=portal.base_url, cache=Cache(), retries=0) as api:
+            assert list(api.records('resource-id').all()) == []
+            assert list(api.records('resource-id').all()) == []
+            assert portal.stats['requests'] == 2
+            assert api.cache.stats['hits'] == 0
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+from pyportal import columnar
+
+
+def test_infer_and_widen_types():
+    assert columnar.infer_type([None, None]) is None
+    assert columnar.infer_type([1, None, 2]) == columnar.INT
+    assert columnar.infer_type([1, 2.5]) == columnar.FLOAT
+    assert columnar.infer_type([True, 1]) == columnar.STRING
+    assert columnar.widen(None, columnar.INT) == columnar.INT
+    assert columnar.widen(columnar.INT, columnar.FLOAT) == columnar.FLOAT
+    assert columnar.widen(columnar.FLOAT, columnar.STRING) == columnar.STRING
+
+
+def test_arrow_batches_widen_across_pages():
+    pytest.importorskip('pyarrow')
+    records = [{'a': None, 'b': 1}, {'a': None, 'b': 2}, {'a': 'x', 'b': 2.5, 'c': 'ignored'}]
+    batches = list(columnar.iter_batches(records, batch_size=2))
+    assert [b.num_rows for b in batches] == [2, 1]
+    assert [str(t) for t in batches[0].schema.types] == ['null', 'int64']
+    assert [str(t) for t in batches[1].schema.types] == ['string', 'double']
+    assert batches[1].schema.names == ['a', 'b']
+
+
+def test_numpy_batches():
+    np = pytest.importorskip('numpy')
+    records = [{'a': 1, 'b': 1.5, 'c': 'x'}, {'a': 2, 'b': None, 'c': None}]
+    batch = next(columnar.iter_batches(records, columns=['a', 'b', 'c'], fmt='numpy'))
+    assert batch['a'].dtype == np.int64
+    assert np.isnan(batch['b'][1])
+    assert list(batch['c']) == ['x', None]
+
+
+def test_write_parquet(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    records = ({'_id': i, 'genus': None if i < 5 else 'Bufo', 'count': i} for i in range(12))
+    path = str(tmp_path / 'records.parquet')
+    assert columnar.write_parquet(records, path, batch_size=5) == 12
+    f = pq.ParquetFile(path)
+    assert f.metadata.num_row_groups == 3
+    assert [str(t) for t in f.schema_arrow.types] == ['int64', 'string', 'int64']
+    assert f.read().column('genus').to_pylist() == [None] * 5 + ['Bufo'] * 7
+
+
+def test_write_parquet_rejects_values_that_do_not_fit(tmp_path):
+    pytest.importorskip('pyarrow.parquet')
+    records = [{'_id': i, 'value': i} for i in range(5)] + \
+              [{'_id': 5, 'value': 2.5}, {'_id': 6, 'value': 'abc'}]
+    with pytest.raises(ValueError, match='pass a schema'):
+        columnar.write_parquet(records, str(tmp_path / 'records.parquet'), batch_size=5)
+
+
+def test_write_parquet_with_schema_keeps_every_value(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    pq = pytest.importorskip('pyarrow.parquet')
+    records = [{'value': i} for i in range(5)] + [{'value': 2.5}]
+    path = str(tmp_path / 'records.parquet')
+    schema = pa.schema([('value', pa.float64())])
+    assert columnar.write_parquet(records, path, batch_size=5, schema=schema) == 6
+    assert pq.read_table(path).column('value').to_pylist() == [0, 1, 2, 3, 4, 2.5]
+
+
+def test_asset_batches(api):
+    pytest.importorskip('pyarrow')
+    api.session.records = [{'_id': 1, 'associatedMedia': '[{"assetID": "a1"}]'},
+                           {'_id': 2, 'associatedMedia': None},
+                           {'_id': 3, 'associatedMedia': [{'assetID': 'a3'}]}]
+    for compact in (False, True):
+        batch = next(api.assets('resource-id', compact=compact).iter_batches())
+        assert batch.schema.names == ['record_id', 'media']
+        assert batch.column('record_id').to_pylist() == [1, 3]
+        media = [json.loads(m) for m in batch.column('media').to_pylist()]
+        assert media == [[{'assetID': 'a1'}], [{'assetID': 'a3'}]]
+
+
+def test_batch_columns_are_the_requested_fields(api):
+    pytest.importorskip('pyarrow')
+    api.session.records = [{'_id': i, 'genus': 'g', 'country': 'x'} for i in range(1, 11)]
+    search = api.records('resource-id', fields=['genus'], sort=['country asc'],
+                         pagination='cursor')
+    assert next(search.iter_batches()).schema.names == ['genus']
+
+
+def test_search_numpy_batches(api):
+    pytest.importorskip('numpy')
+    batch = next(api.records('resource-id').iter_batches(batch_size=100, fmt='numpy'))
+    assert list(batch['_id']) == list(range(1, 101))
@@ -0,0 +1,68 @@
+import requests
+from conftest import FakeResponse
+from pyportal.control import PageSizer, RequestController, TokenBucket, retry_after
+
+
+def responses(*items):
+    items = list(items)
+
+    def request():
+        item = items.pop(0)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    return request
+
+
+def test_retry_after():
+    assert retry_after(FakeResponse(status_code=429, headers={'Retry-After': '3'})) == 3
+    date = 'Wed, 21 Oct 2015 07:28:00 GMT'
+    assert retry_after(FakeResponse(status_code=429, headers={'Retry-After': date})) == 0
+    assert retry_after(FakeResponse(status_code=429)) is None
+
+
+def test_backoff_is_bounded_and_jittered():
+    controller = RequestController(backoff=1, max_backoff=4)
+    for attempt, ceiling in [(0, 1), (1, 2), (2, 4), (5, 4)]:
+        assert ceiling / 2 <= controller.delay(attempt) <= ceiling
+    assert controller.delay(0, FakeResponse(status_code=503, headers={'Retry-After': '10'})) == 10
+
+
+def test_retries_transient_failures():
+    controller = RequestController(retries=3, backoff=0, adaptive_limit=True)
+    request = responses(FakeResponse(status_code=503), requests.ConnectionError(),
+                        FakeResponse(status_code=200))
+    assert controller.send(request).status_code == 200
+    assert controller.page_sizer.limit == 250
+
+
+def test_gives_up_after_retries():
+    controller = RequestController(retries=1, backoff=0)
+    request = responses(FakeResponse(status_code=500), FakeResponse(status_code=502),
+                        FakeResponse(status_code=200))
+    assert controller.send(request).status_code == 502
+    # client errors other than 429 aren't retried
+    request = responses(FakeResponse(status_code=404))
+    assert RequestController(backoff=0).send(request).status_code == 404
+
+
+def test_rate_halves_when_throttled():
+    bucket = TokenBucket(8)
+    bucket.throttled()
+    assert bucket.rate == 4
+    for _ in range(1000):
+        bucket.succeeded()
+    assert bucket.rate == 8
+
+
+def test_page_sizer():
+    sizer = PageSizer(limit=1000, minimum=100, maximum=4000, target_latency=2)
+    sizer.observe(0.5)
+    sizer.observe(0.5)
+    sizer.observe(0.5)
+    assert sizer.limit == 4000
+    sizer.observe(3)
+    assert sizer.limit == 2000
+    sizer.observe(1.5)
+    assert sizer.limit == 2000
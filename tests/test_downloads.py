@@ -0,0 +1,85 @@
+import os
+
+import pytest
+import requests
+from conftest import FakeResponse, FakeSession
+from pyportal.downloads import AssetDownloader
+
+
+def assets():
+    yield 1, [{'assetID': 'a1'}, {'assetID': 'a2'}]
+    yield 2, {'assetID': 'a3'}
+    yield 3, [{'assetID': 'a1'}, {'title': 'no id'}]
+
+
+def test_downloads_each_asset_once(tmp_path):
+    session = FakeSession()
+    stats = AssetDownloader(session, str(tmp_path), workers=2, chunk_size=7).run(assets())
+    assert sorted(os.listdir(tmp_path)) == ['a1.jpg', 'a2.jpg', 'a3.jpg']
+    assert (tmp_path / 'a2.jpg').read_bytes() == b'a2' * 100
+    assert stats.images == 3
+    assert stats.bytes == 600
+    assert stats.failed == 0
+
+
+def test_skips_and_resumes(tmp_path):
+    (tmp_path / 'a1.jpg').write_bytes(b'a1' * 100)
+    (tmp_path / 'a2.jpg').write_bytes(b'a2')
+    (tmp_path / 'a3.jpg.part').write_bytes(b'a3' * 40)
+    session = FakeSession()
+    stats = AssetDownloader(session, str(tmp_path)).run(assets())
+    assert stats.skipped == 1
+    assert stats.images == 2
+    assert (tmp_path / 'a2.jpg').read_bytes() == b'a2' * 100
+    assert (tmp_path / 'a3.jpg').read_bytes() == b'a3' * 100
+    assert not (tmp_path / 'a3.jpg.part').exists()
+    assert {'Range': 'bytes=80-'} in [h for u, h in session.downloads]
+
+
+class FailingHeadSession(FakeSession):
+    def head(self, url, **kwargs):
+        raise requests.ConnectionError('no connection')
+
+
+class BadLengthSession(FakeSession):
+    def head(self, url, **kwargs):
+        return FakeResponse(headers={'Content-Length': 'unknown'}, url=url)
+
+
+def test_unverified_files_are_downloaded_again(tmp_path):
+    (tmp_path / 'a1.jpg').write_bytes(b'a1')
+    stats = AssetDownloader(FailingHeadSession(), str(tmp_path)).run(assets())
+    assert stats.skipped == 0
+    assert stats.images == 3
+    assert (tmp_path / 'a1.jpg').read_bytes() == b'a1' * 100
+
+
+def test_unreadable_sizes_are_downloaded_again(tmp_path):
+    (tmp_path / 'a1.jpg').write_bytes(b'a1')
+    stats = AssetDownloader(BadLengthSession(), str(tmp_path)).run(assets())
+    assert stats.failed == 0
+    assert stats.images == 3
+    assert (tmp_path / 'a1.jpg').read_bytes() == b'a1' * 100
+
+
+class BrokenSession(FakeSession):
+    def get(self, url, **kwargs):
+        if 'a2' in url:
+            raise RuntimeError('unexpected')
+        return super(BrokenSession, self).get(url, **kwargs)
+
+
+def test_unexpected_errors_are_counted(tmp_path):
+    stats = AssetDownloader(BrokenSession(), str(tmp_path)).run(assets())
+    assert stats.failed == 1
+    assert stats.images == 2
+
+
+def test_download_assets_raises_if_a_page_fails(api, tmp_path):
+    api.session.records = [{'_id': i, 'associatedMedia': [{'assetID': f'a{i}'}]}
+                           for i in range(1, 2501)]
+    api.session.errors = {1: 500}
+    with pytest.raises(requests.HTTPError):
+        api.download_assets('resource-id', str(tmp_path))
+    # the first page was still downloaded
+    assert len(os.listdir(tmp_path)) == 1000
@@ -0,0 +1,60 @@
+import gzip
+import json
+
+import pyportal.cli
+import pytest
+import requests
+from pyportal.cli import cli, parse_filters
+from pyportal.errors import CheckpointError
+
+
+def read_ids(path):
+    with gzip.open(path, 'rt') as f:
+        return [json.loads(line)['_id'] for line in f]
+
+
+def test_export_and_verify(api, tmp_path):
+    path = str(tmp_path / 'records.ndjson.gz')
+    assert api.export('resource-id', path, chunk_size=1500) == 2500
+    assert read_ids(path) == list(range(1, 2501))
+    with open(path + '.checkpoint') as f:
+        assert json.load(f)['complete']
+
+
+@pytest.mark.parametrize('pagination', ['offset', 'cursor'])
+def test_resume_after_failure(api, tmp_path, pagination):
+    path = str(tmp_path / 'records.ndjson.gz')
+    api.session.errors = {2: 503}
+    with pytest.raises(requests.HTTPError):
+        api.export('resource-id', path, chunk_size=1000, pagination=pagination)
+    assert len(read_ids(path)) == 2000
+
+    assert api.export('resource-id', path, resume=True, pagination=pagination) == 2500
+    assert read_ids(path) == list(range(1, 2501))
+    # the remaining page, and the count (pages by offset need an empty page after the last)
+    assert len(api.session.requests) == (5 if pagination == 'cursor' else 6)
+
+
+def test_resume_rejects_other_searches(api, tmp_path):
+    path = str(tmp_path / 'records.ndjson.gz')
+    api.export('resource-id', path)
+    with pytest.raises(CheckpointError):
+        api.export('resource-id', path, resume=True, country='australia')
+
+
+def test_cli_filters():
+    assert parse_filters(['collectionCode:bot', 'locality:a:b']) == {
+        'collectionCode': 'bot',
+        'locality': 'a:b'
+        }
+    assert cli(['export', 'https://google.com/resource/abc', 'out.ndjson.gz']) == 1
+
+
+def test_cli_reports_failed_requests(api, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(pyportal.cli, 'API', lambda api_key: api)
+    path = str(tmp_path / 'records.ndjson.gz')
+    api.session.errors = {2: 503}
+    assert cli(['export', 'resource-id', path, '--chunk-size', '1000']) == 1
+    assert '2000 records were saved' in capsys.readouterr().err
+    assert cli(['export', 'resource-id', path, '--resume']) == 0
+    assert read_ids(path) == list(range(1, 2501))
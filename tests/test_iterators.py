@@ -0,0 +1,101 @@
+import json
+
+import pyportal
+import pyportal.decoding
+import pytest
+
+
+def test_all_is_serial_by_default(api):
+    records = list(api.records('resource-id').all())
+    assert [r['_id'] for r in records] == list(range(1, 2501))
+
+
+def test_all_prefetch_keeps_order(api):
+    records = list(api.records('resource-id', offset=10).all(workers=3, prefetch=2))
+    assert [r['_id'] for r in records] == list(range(11, 2501))
+
+
+def test_all_prefetch_stops_early(api):
+    records = api.records('resource-id').all(workers=2, prefetch=1)
+    assert next(records)['_id'] == 1
+    records.close()
+    # the count request, the current page, and at most one page ahead
+    assert len(api.session.requests) <= 3
+
+
+def test_cursor_pagination(api):
+    search = api.records('resource-id', offset=10, pagination='cursor')
+    assert search.params['sort'] == ['_id asc']
+    records = list(search.all())
+    assert [r['_id'] for r in records] == list(range(11, 2501))
+    assert all(p['offset'] == 0 for p in api.session.requests[1:])
+    # the last page has no token, so there's no need to request another
+    assert [json.loads(p['after']) for p in api.session.requests[1:]] == [[1010], [2010]]
+
+
+def test_cursor_pagination_without_tokens(api):
+    api.session.tokens = False
+    search = api.records('resource-id', offset=10, pagination='cursor')
+    assert [r['_id'] for r in search.all()] == list(range(11, 2501))
+    assert search.pagination == 'offset'
+    assert [p['offset'] for p in api.session.requests] == [10, 1010, 2010, 2500]
+    assert not any('after' in p for p in api.session.requests)
+
+
+def test_unknown_pagination(api):
+    with pytest.raises(ValueError):
+        api.records('resource-id', pagination='pages')
+
+
+@pytest.mark.parametrize('backend', ['ijson', None])
+def test_all_streamed(api, monkeypatch, backend):
+    if backend is None:
+        monkeypatch.setattr(pyportal.decoding, 'ijson', None)
+    else:
+        pytest.importorskip(backend)
+    records = list(api.records('resource-id', offset=5).all(stream=True))
+    assert [r['_id'] for r in records] == list(range(6, 2501))
+    # the last page reaches the total, so there's no need to request an empty page after it
+    assert len(api.session.requests) == 3
+
+
+def test_assets_streamed(api):
+    api.session.records = [{'_id': 1, 'associatedMedia': '[{"assetID": "a1"}]'},
+                           {'_id': 2, 'associatedMedia': [{'assetID': 'a2'}]}]
+    assets = list(api.assets('resource-id').all(stream=True))
+    assert assets == [(1, [{'assetID': 'a1'}]), (2, [{'assetID': 'a2'}])]
+
+
+def test_all_sharded_by_id(api):
+    records = list(api.records('resource-id').all(shards=4))
+    assert sorted(r['_id'] for r in records) == list(range(1, 2501))
+    # the count, three boundary lookups, and one page for each shard
+    assert len(api.session.requests) == 8
+    afters = {p['after'] for p in api.session.requests if 'after' in p}
+    assert afters == {'[625]', '[1250]', '[1875]'}
+
+
+def test_all_sharded_by_value(api):
+    api.session.records = [{'_id': i, 'code': 'abcde'[i % 5], 'even': i % 2 == 0}
+                           for i in range(1, 2501)]
+    search = api.records('resource-id', even=True)
+    records = list(search.all(shards=2, shard_by='code', shard_values=list('abcde')))
+    assert sorted(r['_id'] for r in records) == list(range(2, 2501, 2))
+    # a count for each value, then the values are split into two shards
+    filters = [json.loads(p['filters']) for p in api.session.requests[6:]]
+    assert {len(f['code']) for f in filters} == {2, 3}
+    assert all(f['even'] for f in filters)
+    with pytest.raises(pyportal.errors.IncompleteResultsError):
+        list(api.records('resource-id').all(shards=2, shard_by='code', shard_values=list('abc')))
+
+
+@pytest.mark.parametrize('pagination', ['offset', 'cursor'])
+def test_only_requested_fields_are_returned(api, pagination):
+    api.session.records = [{'_id': i, 'genus': f'g{i}', 'country': 'x'} for i in range(1, 2501)]
+    search = api.records('resource-id', fields=['genus'], sort=['country asc'],
+                         pagination=pagination)
+    assert search.fields == ['genus']
+    assert list(search.all())[:2] == [{'genus': 'g1'}, {'genus': 'g2'}]
+    records = list(api.records('resource-id', fields=['genus'], pagination=pagination)
+                   .all(shards=2))
+    assert all(list(r) == ['genus'] for r in records) and len(records) == 2500
@@ -0,0 +1,82 @@
+import pyportal
+import pytest
+from benchmarks.server import FakePortal
+from pyportal.cache import Cache
+
+RESOURCE_ID = 'test-resource'
+
+
+@pytest.fixture
+def portal():
+    # more records than all() gets in a page, so searches need more than one
+    with FakePortal(records=2500, seed=5) as portal:
+        # give some records no genus, to check nulls sort the same way in both
+        portal.update([dict(r, genus=None) for r in portal.records[::3]])
+        yield portal
+
+
+@pytest.mark.parametrize('search', [
+    {},
+    {'collectionCode': ['BOT', 'ZOO'], 'country': 'Kenya'},
+    {'sort': ['genus desc', 'year asc'], 'fields': ['_id', 'genus', 'year']},
+    {'sort': ['country desc'], 'pagination': 'cursor', 'fields': ['catalogNumber']},
+    {'sort': ['genus asc'], 'pagination': 'cursor'},
+    {'sort': ['genus desc', 'year asc'], 'pagination': 'cursor'}
+    ])
+def test_local_api_matches_portal(portal, tmp_path, search):
+    path = str(tmp_path / 'mirror.db')
+    with pyportal.API(base_url=portal.base_url) as api:
+        api.mirror(RESOURCE_ID, path, index_fields=['collectionCode'])
+        with pyportal.LocalAPI(path) as local:
+            assert list(local.records(RESOURCE_ID, **search).all()) == \
+                   list(api.records(RESOURCE_ID, **search).all())
+            assert local.records(RESOURCE_ID, **search).count() == \
+                   api.records(RESOURCE_ID, **search).count()
+            assert list(local.assets(RESOURCE_ID).all()) == list(api.assets(RESOURCE_ID).all())
+
+
+def test_mirror_sync(portal, tmp_path):
+    path = str(tmp_path / 'mirror.db')
+    with pyportal.API(base_url=portal.base_url) as api:
+        mirror = api.mirror(RESOURCE_ID, path, modified_field='modified')
+        assert mirror.count() == 2500
+        changed = dict(portal.records[9], locality='changed', modified='2030-01-01T00:00:00')
+        added = dict(portal.records[0], _id=5000, modified='2030-01-02T00:00:00')
+        portal.update([changed, added])
+        portal.reset()
+        result = mirror.sync()
+        assert result['added'] == 1 and result['total'] == 2501
+        # only the first (small) page of recently modified records was needed
+        assert portal.stats['records'] < 200
+        with pyportal.LocalAPI(path) as local:
+            assert local.records(RESOURCE_ID, locality='changed').first()['_id'] == 10
+            assert local.records(RESOURCE_ID, _id=5000).count() == 1
+            with pytest.raises(StopIteration):
+                local.records('another-resource').next()
+
+
+@pytest.mark.parametrize('sort', ['genus descending', 'genus asc,id', 'genus asc id'])
+def test_local_api_rejects_invalid_sorts(portal, tmp_path, sort):
+    path = str(tmp_path / 'mirror.db')
+    with pyportal.API(base_url=portal.base_url) as api:
+        api.mirror(RESOURCE_ID, path)
+    with pyportal.LocalAPI(path) as local:
+        response = local.session.get('', {'resource_id': RESOURCE_ID, 'sort': [sort]})
+        assert response.status_code == 409
+        assert 'not a valid sort' in response.json()['error']['message']
+
+
+def test_mirror_sync_ignores_cache(portal, tmp_path):
+    path = str(tmp_path / 'mirror.db')
+    with pyportal.API(base_url=portal.base_url, cache=Cache()) as api:
+        mirror = api.mirror(RESOURCE_ID, path, modified_field='modified')
+        # a sync with nothing to do, which would fill the cache with its requests
+        assert mirror.sync()['added'] == 0
+        changed = dict(portal.records[9], locality='changed', modified='2030-01-01T00:00:00')
+        added = dict(portal.records[0], _id=5000, modified='2030-01-02T00:00:00')
+        portal.update([changed, added])
+        result = mirror.sync()
+        assert result['added'] == 1 and result['total'] == 2501
+        assert api.cache.stats['hits'] == 0
+    with pyportal.LocalAPI(path) as local:
+        assert local.records(RESOURCE_ID, locality='changed').first()['_id'] == 10
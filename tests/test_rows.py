@@ -0,0 +1,41 @@
+import json
+import pickle
+
+import pyportal.rows
+import pytest
+from pyportal.rows import LazyJSON, RowFactory
+
+
+def test_rows_behave_like_dicts():
+    factory = RowFactory()
+    media = [{'assetID': 'a1'}]
+    records = [{'_id': 1, 'country': 'Kenya', 'associatedMedia': json.dumps(media)},
+               {'_id': 2, 'country': 'Kenya', 'associatedMedia': None}]
+    rows = [factory.row(r) for r in records]
+    assert rows[0]['country'] == rows[0].get('country') == 'Kenya'
+    assert rows[0].get('genus') is None and 'genus' not in rows[0]
+    with pytest.raises(KeyError):
+        rows[0]['genus']
+    assert list(rows[0]) == ['_id', 'country', 'associatedMedia']
+    # JSON fields are decoded when used; to_dict(raw=True) gives back the original record
+    assert rows[0]['associatedMedia'] == media
+    assert rows[0].to_dict() == dict(records[0], associatedMedia=media)
+    assert rows[0].to_dict(raw=True) == records[0]
+    assert rows == records
+    assert pickle.loads(pickle.dumps(rows[0])) == rows[0]
+    # rows with the same fields share a field table, and short values are shared too
+    assert rows[0]._fields is rows[1]._fields
+    assert rows[0]._values[1] is rows[1]._values[1]
+
+
+def test_compact_searches(api):
+    api.session.records = [{'_id': i, 'associatedMedia': json.dumps([{'assetID': f'a{i}'}])}
+                           for i in range(1, 2501)]
+    for kwargs in [{}, {'workers': 2}, {'stream': True}, {'shards': 2}]:
+        records = list(api.records('resource-id', compact=True).all(**kwargs))
+        assert all(isinstance(r, pyportal.rows.Row) for r in records)
+        assert sorted(r['_id'] for r in records) == list(range(1, 2501))
+    assets = api.assets('resource-id', compact=True).next()
+    assert isinstance(assets[0][1], LazyJSON)
+    assert assets[0] == (1, [{'assetID': 'a1'}])
+    assert api.assets('resource-id').first() == (1, [{'assetID': 'a1'}])
@@ -0,0 +1,49 @@
+import pytest
+from pyportal.hooks import Hooks
+from pyportal.stats import SearchStats, percentile
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([1, 2, 3, 4], 100) == 4
+
+
+def test_hooks():
+    hooks = Hooks()
+    seen = []
+
+    def broken(**info):
+        raise RuntimeError
+
+    hooks.add('on_retry', broken)
+    hooks.add('on_retry', lambda **info: seen.append(info))
+    hooks.fire('on_retry', url='u', attempt=1, wait=0, reason='503')
+    assert seen == [{'url': 'u', 'attempt': 1, 'wait': 0, 'reason': '503'}]
+    with pytest.raises(ValueError):
+        hooks.add('on_something', broken)
+
+
+def test_search_stats(api):
+    decoded = []
+    api.session.hooks = Hooks()
+    api.session.hooks.add('on_page_decoded', lambda **info: decoded.append(info['records']))
+    search = api.records('resource-id')
+    for _ in search.all():
+        pass
+    stats = search.stats
+    assert stats.requests == 4
+    assert stats.records == 2500
+    assert stats.bytes > 0
+    assert stats.records_per_second > 0
+    assert set(stats.latency_percentiles()) == {50, 90, 99}
+    assert decoded == [1000, 1000, 500, 0]
+
+
+def test_stats_summary():
+    stats = SearchStats()
+    stats.request(0.5, nbytes=100)
+    stats.page(10, 0.1)
+    assert stats.as_dict()['records'] == 10
+    assert '10 records from 1 requests (100 bytes)' in str(stats)